@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark resolving and counting commits with
+:class:`preprint.gitobjects.CommitResolver` against the original GitPython
+helpers that materialize the whole history.
+
+Usage::
+
+    python benchmarks/bench_commits.py [N_COMMITS]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from preprint.cache import TextCache
+from preprint.gitobjects import GitObjectReader, CommitResolver
+
+
+def make_repo(repo_dir, n_commits):
+    """Make a repository with a linear history of `n_commits` commits."""
+    subprocess.check_call(['git', 'init', '-q', repo_dir])
+    lines = []
+    for i in range(n_commits):
+        content = "Revision {0:d}\n".format(i)
+        message = "Commit {0:d}\n".format(i)
+        lines.append("commit refs/heads/master")
+        lines.append("committer Bench <bench@example.com> {0:d} +0000".format(
+            1400000000 + i))
+        lines.append("data {0:d}".format(len(message)))
+        lines.append(message)
+        lines.append("M 644 inline paper.tex")
+        lines.append("data {0:d}".format(len(content)))
+        lines.append(content)
+    p = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=repo_dir,
+                         stdin=subprocess.PIPE)
+    p.communicate("\n".join(lines) + "\n")
+    subprocess.check_call(['git', 'checkout', '-q', 'master'], cwd=repo_dir)
+
+
+def legacy_helpers(repo_dir, sha):
+    """The original full-history helpers, built on GitPython."""
+    import git
+    repo = git.Repo(repo_dir)
+    n = len(list(repo.iter_commits()))
+    for cm in list(repo.iter_commits()):
+        if cm.hexsha.startswith(sha):
+            break
+    return n
+
+
+def resolver_helpers(repo_dir, sha, cache_dir):
+    """The same queries answered by a fresh CommitResolver."""
+    resolver = CommitResolver(GitObjectReader(repo_dir),
+                              cache=TextCache('commits', cache_dir=cache_dir))
+    n = resolver.count()
+    resolver.match(sha)
+    return n
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main(n_commits=5000):
+    tmp = tempfile.mkdtemp()
+    try:
+        repo_dir = os.path.join(tmp, "repo")
+        cache_dir = os.path.join(tmp, "cache")
+        make_repo(repo_dir, n_commits)
+        # Match the oldest commit: the worst case for a linear scan
+        oldest = subprocess.check_output(
+            ['git', 'rev-list', '--max-parents=0', 'HEAD'],
+            cwd=repo_dir).strip()[:7]
+        print "{0:d} commits".format(n_commits)
+        try:
+            print "legacy GitPython helpers: {0:.3f} s".format(
+                timed(legacy_helpers, repo_dir, oldest))
+        except ImportError:
+            print "legacy GitPython helpers: skipped (GitPython not installed)"
+        print "CommitResolver (cold index): {0:.3f} s".format(
+            timed(resolver_helpers, repo_dir, oldest, cache_dir))
+        print "CommitResolver (cached index): {0:.3f} s".format(
+            timed(resolver_helpers, repo_dir, oldest, cache_dir))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
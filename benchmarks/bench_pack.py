@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the rewriting of figure paths by ``preprint pack``
+(:func:`preprint.pack.rewrite_figure_paths`) against the former approach of
+one ``str.replace`` over the whole document per figure.
+
+Usage::
+
+    python benchmarks/bench_pack.py [N_FIGURES [N_REPEATS]]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from preprint.pack import figs_pattern, rewrite_figure_paths
+
+
+WORDS = (u"galaxy star disk halo stellar mass metallicity age population "
+         u"the of and in a to is we that with for are by this our").split()
+
+
+def make_document(n_figures, rng):
+    """Make a document with `n_figures` figures between paragraphs."""
+    lines = [u"\\documentclass{article}", u"\\begin{document}"]
+    for i in range(n_figures):
+        for j in range(4):
+            lines.append(u" ".join(rng.choice(WORDS) for k in range(120)))
+            lines.append(u"")
+        lines.append(u"\\begin{figure}")
+        lines.append(u"\\includegraphics[width=\\columnwidth]"
+                     u"{{figures/panel_{0:04d}}}".format(i))
+        lines.append(u"\\caption{{Figure {0:d}.}}".format(i))
+        lines.append(u"\\end{figure}")
+    lines.append(u"\\end{document}")
+    return u"\n".join(lines) + u"\n"
+
+
+def replace_each(tex, new_paths):
+    """Rewrite figure paths with one pass over the document per figure."""
+    for opts, path in figs_pattern.findall(tex):
+        old_fig_cmd = u"\\includegraphics{0}{{{1}}}".format(opts, path)
+        new_fig_cmd = u"\\includegraphics{0}{{{1}}}".format(
+            opts, new_paths[path])
+        tex = tex.replace(old_fig_cmd, new_fig_cmd)
+    return tex
+
+
+def timed(func, n_repeats, *args):
+    start = time.time()
+    for i in range(n_repeats):
+        result = func(*args)
+    return (time.time() - start) / n_repeats, result
+
+
+def main(n_figures=400, n_repeats=5):
+    rng = random.Random(42)
+    tex = make_document(n_figures, rng)
+    new_paths = dict((path, u"f{0:d}".format(i + 1))
+                     for i, (opts, path) in
+                     enumerate(figs_pattern.findall(tex)))
+    print "{0:d} figures, {1:.1f} MB document".format(
+        n_figures, len(tex.encode('utf-8')) / 1e6)
+    replace_time, replaced = timed(replace_each, n_repeats, tex, new_paths)
+    print "replace per figure: {0:.4f} s".format(replace_time)
+    single_time, rewritten = timed(rewrite_figure_paths, n_repeats, tex,
+                                   new_paths)
+    print "single pass: {0:.4f} s".format(single_time)
+    assert rewritten == replaced
+
+
+if __name__ == '__main__':
+    kwargs = {}
+    if len(sys.argv) > 1:
+        kwargs['n_figures'] = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        kwargs['n_repeats'] = int(sys.argv[2])
+    main(**kwargs)
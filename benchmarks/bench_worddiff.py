@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the built-in word diff engine (:mod:`preprint.worddiff`) against
+the external ``latexdiff`` tool on generated documents.
+
+Usage::
+
+    python benchmarks/bench_worddiff.py [N_SECTIONS [EDIT_FRACTION]]
+"""
+
+import os
+import sys
+import time
+import codecs
+import random
+import shutil
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from preprint.worddiff import diff_tex
+from preprint.latexdiff import LATEXDIFF_OPTIONS
+
+
+WORDS = (u"galaxy star disk halo stellar mass metallicity age population "
+         u"the of and in a to is we that with for are by this our").split()
+
+
+def make_document(n_sections, rng):
+    """Make a document with `n_sections` sections of random paragraphs."""
+    lines = [u"\\documentclass{article}", u"\\begin{document}"]
+    for i in range(n_sections):
+        lines.append(u"\\section{{Section {0:d}}}".format(i))
+        lines.append(u"\\label{{sec:{0:d}}}".format(i))
+        for j in range(6):
+            words = [rng.choice(WORDS) for k in range(120)]
+            words[10] = u"\\citep{{ref{0:d}}}".format(j)
+            words[40] = u"$M_\\star$"
+            lines.append(u" ".join(words) + u".")
+            lines.append(u"")
+        lines.append(u"\\begin{equation}")
+        lines.append(u"E_{0:d} = mc^2".format(i))
+        lines.append(u"\\end{equation}")
+    lines.append(u"\\end{document}")
+    return u"\n".join(lines) + u"\n"
+
+
+def edit_document(tex, fraction, rng):
+    """Replace, insert or delete a `fraction` of the words of a document."""
+    lines = tex.split(u"\n")
+    for i, line in enumerate(lines):
+        if not line or line.startswith(u"\\"):
+            continue
+        words = line.split(u" ")
+        for k in range(len(words)):
+            if rng.random() < fraction:
+                words[k] = rng.choice([u"", rng.choice(WORDS),
+                                       words[k] + u" " + rng.choice(WORDS)])
+        lines[i] = u" ".join(w for w in words if w)
+    return u"\n".join(lines)
+
+
+def run_latexdiff(prev_path, current_path, output_path):
+    with open(output_path, 'w') as f:
+        subprocess.check_call(['latexdiff', LATEXDIFF_OPTIONS, prev_path,
+                               current_path], stdout=f)
+
+
+def run_worddiff(prev_path, current_path, output_path):
+    with codecs.open(prev_path, 'r', encoding='utf-8') as f:
+        prev_tex = f.read()
+    with codecs.open(current_path, 'r', encoding='utf-8') as f:
+        current_tex = f.read()
+    with codecs.open(output_path, 'w', encoding='utf-8') as f:
+        f.write(diff_tex(prev_tex, current_tex))
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main(n_sections=50, fraction=0.02):
+    rng = random.Random(42)
+    prev_tex = make_document(n_sections, rng)
+    current_tex = edit_document(prev_tex, fraction, rng)
+    tmp = tempfile.mkdtemp()
+    try:
+        prev_path = os.path.join(tmp, "prev.tex")
+        current_path = os.path.join(tmp, "current.tex")
+        for path, tex in ((prev_path, prev_tex), (current_path, current_tex)):
+            with codecs.open(path, 'w', encoding='utf-8') as f:
+                f.write(tex)
+        print "{0:d} sections, {1:d} words, {2:.0%} of words edited".format(
+            n_sections, len(prev_tex.split()), fraction)
+        print "python engine: {0:.3f} s".format(
+            timed(run_worddiff, prev_path, current_path,
+                  os.path.join(tmp, "worddiff.tex")))
+        if find_executable('latexdiff') is None:
+            print "latexdiff: skipped (latexdiff not installed)"
+        else:
+            print "latexdiff: {0:.3f} s".format(
+                timed(run_latexdiff, prev_path, current_path,
+                      os.path.join(tmp, "latexdiff.tex")))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    kwargs = {}
+    if len(sys.argv) > 1:
+        kwargs['n_sections'] = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        kwargs['fraction'] = float(sys.argv[2])
+    main(**kwargs)
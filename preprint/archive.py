@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Submission archives (``.tar.gz`` or ``.zip``) that are written member by
+member, streaming files in rather than loading them into memory, with the
+SHA-256 sum of each member.
+"""
+
+import io
+import os
+import time
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+
+from .filehash import file_digest
+
+
+ARCHIVE_FORMATS = ("tar.gz", "zip")
+
+
+class SubmissionArchive(object):
+    """Archive of a packaged manuscript.
+
+    The archive is written to a temporary file next to `path` and only moved
+    into place by :meth:`close`, along with a ``sha256sum``-style manifest of
+    its members at ``path + ".sha256"``.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive.
+    fmt : str
+        Archive format, one of :data:`ARCHIVE_FORMATS`.
+    """
+
+    def __init__(self, path, fmt):
+        super(SubmissionArchive, self).__init__()
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError("Unknown archive format {0}".format(fmt))
+        self.path = path
+        self.checksums = []
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd, self._tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        os.close(fd)
+        if fmt == "tar.gz":
+            self._tar = tarfile.open(self._tmp_path, 'w:gz')
+            self._zip = None
+        else:
+            self._tar = None
+            self._zip = zipfile.ZipFile(self._tmp_path, 'w',
+                                        zipfile.ZIP_DEFLATED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_file(self, src_path, arcname):
+        """Stream the file at `src_path` into the archive as `arcname`."""
+        if self._tar is not None:
+            h = hashlib.sha256()
+            st = os.stat(src_path)
+            with open(src_path, 'rb') as f:
+                info = self._tar_info(arcname, st.st_size, st.st_mtime)
+                self._tar.addfile(info, _HashingReader(f, h))
+            digest = h.hexdigest()
+        else:
+            # ZipFile can only stream a file in from its path, so hash it in
+            # a separate (chunked) pass
+            digest = file_digest(src_path, algorithm='sha256')
+            self._zip.write(src_path, arcname)
+        self.checksums.append((digest, arcname))
+
+    def add_text(self, text, arcname):
+        """Add unicode `text` to the archive as the UTF-8 file `arcname`."""
+        data = text.encode('utf-8')
+        if self._tar is not None:
+            info = self._tar_info(arcname, len(data), time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+        else:
+            self._zip.writestr(self._zip_info(arcname, time.time()), data)
+        self.checksums.append((hashlib.sha256(data).hexdigest(), arcname))
+
+    def close(self):
+        """Finish the archive and write its manifest."""
+        self._close_archive()
+        # mkstemp creates files that only the owner can read
+        os.chmod(self._tmp_path, 0644)
+        os.rename(self._tmp_path, self.path)
+        with open(self.path + ".sha256", 'w') as f:
+            for digest, arcname in self.checksums:
+                f.write(u"{0}  {1}\n".format(digest, arcname).encode('utf-8'))
+
+    def abort(self):
+        """Discard the partially written archive."""
+        self._close_archive()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def _close_archive(self):
+        if self._tar is not None:
+            self._tar.close()
+        else:
+            self._zip.close()
+
+    def _tar_info(self, arcname, size, mtime):
+        info = tarfile.TarInfo(arcname.encode('utf-8')
+                               if isinstance(arcname, unicode) else arcname)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0644
+        return info
+
+    def _zip_info(self, arcname, mtime):
+        info = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0644 << 16
+        return info
+
+
+class _HashingReader(object):
+    """File-like wrapper that hashes the data read through it."""
+
+    def __init__(self, f, h):
+        super(_HashingReader, self).__init__()
+        self._f = f
+        self._h = h
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._h.update(data)
+        return data
+
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Find the first commit that breaks the build, compiling several candidate
+revisions at once.
+
+Each round of the bisection builds ``jobs`` revisions, evenly spaced between
+the last revision known to build and the first known to fail, in parallel
+worker processes. Every probe is built from git objects in its own scratch
+directory (see :mod:`preprint.revbuild`), so the working tree is never
+touched. With ``jobs`` probes per round, the range of candidates shrinks by
+a factor of ``jobs + 1`` per round instead of 2. The good and bad revisions
+are built first, to check that they build (and fail) the same way in the
+scratch directories.
+"""
+
+import math
+import time
+import shutil
+import logging
+import subprocess
+import multiprocessing
+
+from cliff.command import Command
+
+from .gitobjects import get_reader, get_resolver, TreeFiles
+from .revbuild import input_closure, compile_tree
+from .scratch import make_scratch_dir
+
+
+class Bisect(Command):
+    """Find the first commit that fails to compile"""
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(Bisect, self).get_parser(prog_name)
+        parser.add_argument(
+            'good',
+            help="Commit SHA or tag of a revision that compiles.")
+        parser.add_argument(
+            'bad',
+            nargs='?',
+            default='HEAD',
+            help="Commit SHA or tag of a revision that fails to compile "
+                 "(defaults to HEAD).")
+        parser.add_argument(
+            '--cmd',
+            default=self.app.confs.config('cmd'),
+            help="Command to run for compilation")
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Number of revisions to build at once.")
+        return parser
+
+    def take_action(self, parsed_args):
+        master = self.app.options.master
+        cmd = parsed_args.cmd.format(master=master)
+        scratch_root = self.app.confs.config('scratch_dir')
+        resolver = get_resolver(master)
+        good = resolver.resolve(parsed_args.good)
+        bad = resolver.resolve(parsed_args.bad)
+        for ref, sha in ((parsed_args.good, good), (parsed_args.bad, bad)):
+            if sha is None:
+                raise ValueError("Cannot find commit {0}".format(ref))
+        candidates = resolver.rev_range("{0}..{1}".format(good, bad))
+        if not candidates or candidates[-1] != bad:
+            raise ValueError("{0} is not an ancestor of {1}".format(
+                parsed_args.good, parsed_args.bad))
+        self.log.info("Bisecting {0:d} commit(s) with {1:d} build(s) "
+                      "per round".format(len(candidates), parsed_args.jobs))
+
+        pool = multiprocessing.Pool(max(1, parsed_args.jobs))
+        try:
+            def probe(shas):
+                tasks = [(sha, master, cmd, scratch_root) for sha in shas]
+                results = pool.map_async(_probe_task, tasks).get(1e9)
+                for sha, ok, elapsed in results:
+                    self.log.info("{0} {1} ({2:.1f} s)".format(
+                        sha[:7], "builds" if ok else "fails", elapsed))
+                return [ok for sha, ok, elapsed in results]
+
+            start = time.time()
+            # Check that the endpoints behave as claimed in the scratch
+            # builds; if GOOD fails there (say, because an input is not
+            # committed), every probe would fail too.
+            good_ok, bad_ok = probe([good, bad])
+            if not good_ok:
+                raise ValueError(
+                    "{0} does not build from git; check that all of its "
+                    "inputs are committed".format(parsed_args.good))
+            if bad_ok:
+                raise ValueError("{0} builds; nothing to bisect".format(
+                    parsed_args.bad))
+            first_bad, rounds = parallel_bisect(candidates, probe,
+                                                parsed_args.jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        summary = subprocess.check_output(
+            ['git', 'log', '-1', '--format=%h %s', first_bad],
+            cwd=get_reader(master).repo_dir).strip()
+        self.log.info("First failing commit: {0}".format(summary))
+        self.log.info(
+            "Found in {0:d} round(s), {1:.1f} s (a sequential bisect takes "
+            "up to {2:d} rounds)".format(
+                rounds, time.time() - start,
+                int(math.ceil(math.log(len(candidates), 2)))))
+
+
+def parallel_bisect(candidates, probe, jobs):
+    """Find the first failing revision, probing several at a time.
+
+    The revision before the first candidate is assumed to build, and the
+    last candidate to fail.
+
+    Parameters
+    ----------
+    candidates : list
+        Candidate revisions, oldest first.
+    probe : callable
+        Function that takes a list of candidates and returns a list of
+        booleans, `True` for each candidate that builds.
+    jobs : int
+        Number of candidates to probe per round.
+
+    Returns
+    -------
+    first_bad : object
+        The first candidate that fails.
+    rounds : int
+        Number of rounds of probes.
+    """
+    # Indices of the last candidate known to build and the first known to
+    # fail
+    lo, hi = -1, len(candidates) - 1
+    rounds = 0
+    while hi - lo > 1:
+        n = min(max(1, jobs), hi - lo - 1)
+        indices = [lo + (i + 1) * (hi - lo) // (n + 1) for i in range(n)]
+        results = probe([candidates[i] for i in indices])
+        rounds += 1
+        failing = [i for i, ok in zip(indices, results) if not ok]
+        if failing:
+            hi = min(failing)
+        passing = [i for i, ok in zip(indices, results) if ok and i < hi]
+        if passing:
+            lo = max(passing)
+    return candidates[hi], rounds
+
+
+def _probe_task(task):
+    """Build a revision in a scratch directory, in a worker process.
+
+    Returns
+    -------
+    sha : str
+        The revision.
+    ok : bool
+        `True` if the build command succeeded.
+    elapsed : float
+        Build time, in seconds.
+    """
+    sha, master_path, cmd, scratch_root = task
+    start = time.time()
+    work_dir = make_scratch_dir(prefix="preprint-bisect-", root=scratch_root)
+    try:
+        files = TreeFiles(get_reader(master_path), sha)
+        status, pdf_path = compile_tree(files,
+                                        input_closure(files, master_path),
+                                        master_path, cmd, work_dir,
+                                        quiet=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return sha, status == 0, time.time() - start
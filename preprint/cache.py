@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+On-disk caches for intermediate products, stored in the project's
+``.preprint-cache/`` directory.
+
+Each cache lives in its own sub-directory and holds one file per entry,
+named by a content-derived key. Caches are capped in size; when a cache
+grows beyond its cap the least recently used entries are evicted.
+"""
+
+import os
+import codecs
+import shutil
+import hashlib
+import logging
+import tempfile
+
+
+CACHE_DIR = ".preprint-cache"
+DEFAULT_MAX_SIZE = 256 * 1024 ** 2  # bytes
+
+
+def cache_key(*parts):
+    """Make a cache key from strings `parts`."""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class TextCache(object):
+    """Cache of unicode text documents, held in memory and on disk.
+
+    Parameters
+    ----------
+    namespace : str
+        Name of the cache's sub-directory within `cache_dir`.
+    cache_dir : str
+        Root directory of preprint's caches.
+    max_size : int
+        Maximum size of the on-disk cache, in bytes. Least recently used
+        entries are evicted once the cache grows beyond this size.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, namespace, cache_dir=CACHE_DIR,
+                 max_size=DEFAULT_MAX_SIZE):
+        super(TextCache, self).__init__()
+        self._dir = os.path.join(cache_dir, namespace)
+        self._max_size = max_size
+        self._memory = {}
+
+    def _path(self, key):
+        return os.path.join(self._dir, key + ".txt")
+
+    def get(self, key):
+        """Get the text stored for `key`, or `None` if it is not cached."""
+        path = self._path(key)
+        if key in self._memory:
+            _touch(path)
+            return self._memory[key]
+        try:
+            with codecs.open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except IOError:
+            self.log.debug("Cache miss {0}".format(path))
+            return None
+        _touch(path)
+        self._memory[key] = text
+        return text
+
+    def put(self, key, text):
+        """Store `text` for `key`."""
+        self._memory[key] = text
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+        # Write atomically so concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        with codecs.getwriter('utf-8')(os.fdopen(fd, 'wb')) as f:
+            f.write(text)
+        os.rename(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits its cap."""
+        for name in _evict(self._dir, self._max_size, self.log):
+            self._memory.pop(os.path.splitext(name)[0], None)
+
+
+class FileCache(object):
+    """Cache of files (such as built PDFs), stored on disk.
+
+    Parameters
+    ----------
+    namespace : str
+        Name of the cache's sub-directory within `cache_dir`.
+    cache_dir : str
+        Root directory of preprint's caches.
+    max_size : int
+        Maximum size of the cache, in bytes. Least recently used entries are
+        evicted once the cache grows beyond this size.
+    ext : str
+        Extension of the cached files (such as ``".pdf"``).
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, namespace, cache_dir=CACHE_DIR,
+                 max_size=DEFAULT_MAX_SIZE, ext=""):
+        super(FileCache, self).__init__()
+        self._dir = os.path.join(cache_dir, namespace)
+        self._max_size = max_size
+        self._ext = ext
+
+    def _path(self, key):
+        return os.path.join(self._dir, key + self._ext)
+
+    def get(self, key):
+        """Path of the file cached for `key`, or `None` if it is not cached.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.log.debug("Cache miss {0}".format(path))
+            return None
+        _touch(path)
+        return path
+
+    def put(self, key, src_path):
+        """Store a copy of the file at `src_path` for `key`.
+
+        Returns
+        -------
+        path : str
+            Path of the cached copy.
+        """
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+        # Copy atomically so concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        os.rename(tmp_path, self._path(key))
+        _evict(self._dir, self._max_size, self.log)
+        return self._path(key)
+
+
+def _evict(cache_dir, max_size, log):
+    """Delete least recently used entries of a cache directory until it fits
+    within `max_size` bytes.
+
+    Returns
+    -------
+    names : list
+        Filenames of the evicted entries.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".tmp"):
+            # Entry still being written by another process
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name, path))
+    total = sum(e[1] for e in entries)
+    evicted = []
+    for mtime, size, name, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        evicted.append(name)
+        log.debug("Evicted {0} from cache".format(path))
+    return evicted
+
+
+def _touch(path):
+    """Mark the cache entry at `path` as recently used."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
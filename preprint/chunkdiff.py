@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Split inlined LaTeX documents at ``\\section``/``\\chapter`` boundaries so
+that matching sections can be run through latexdiff independently (and in
+parallel), and stitch the results back into a single document.
+"""
+
+import re
+import difflib
+
+
+section_pattern = re.compile(ur"^[ \t]*\\(?:chapter|section)\*?\s*[\[{]",
+                             re.UNICODE | re.MULTILINE)
+begin_document_pattern = re.compile(ur"\\begin\s*{document}", re.UNICODE)
+end_document_pattern = re.compile(ur"\\end\s*{document}", re.UNICODE)
+
+
+class SplitDocument(object):
+    """A LaTeX document split into its preamble, sections and postamble.
+
+    Attributes
+    ----------
+    preamble : unicode
+        Text up to and including ``\\begin{document}``.
+    sections : list
+        Body text, split before each ``\\section`` or ``\\chapter``. The
+        first item is the front matter before the first section (which may
+        be empty).
+    postamble : unicode
+        Text from ``\\end{document}`` onwards.
+    """
+
+    def __init__(self, preamble, sections, postamble):
+        super(SplitDocument, self).__init__()
+        self.preamble = preamble
+        self.sections = sections
+        self.postamble = postamble
+
+    @property
+    def headings(self):
+        """Heading line of each section (empty for the front matter)."""
+        return [section_heading(s) for s in self.sections]
+
+
+def split_document(tex):
+    """Split a LaTeX document at its ``\\section``/``\\chapter`` boundaries.
+
+    Returns
+    -------
+    doc : :class:`SplitDocument`
+        The split document, or `None` if `tex` is not a complete document.
+    """
+    begin = begin_document_pattern.search(tex)
+    if begin is None:
+        return None
+    end = end_document_pattern.search(tex, begin.end())
+    if end is None:
+        return None
+    body = tex[begin.end():end.start()]
+    starts = [0] + [m.start() for m in section_pattern.finditer(body)
+                    if m.start() > 0]
+    ends = starts[1:] + [len(body)]
+    sections = [body[i:j] for i, j in zip(starts, ends)]
+    return SplitDocument(tex[:begin.end()], sections, tex[end.start():])
+
+
+def section_heading(section):
+    """The heading line of a section, or an empty string if the text does not
+    start with a sectioning command.
+    """
+    if section_pattern.match(section) is None:
+        return u""
+    return section.strip().splitlines()[0].strip()
+
+
+def align_sections(prev_doc, current_doc):
+    """Pair the sections of two versions of a document.
+
+    Sections are aligned by their headings. Renamed sections are paired by
+    position, but if sections were added, removed or moved the documents
+    cannot be aligned.
+
+    Returns
+    -------
+    pairs : list
+        List of ``(prev_section, current_section)`` tuples, or `None` if the
+        sections cannot be aligned one-to-one.
+    """
+    matcher = difflib.SequenceMatcher(None, prev_doc.headings,
+                                      current_doc.headings, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        elif tag == 'replace' and i2 - i1 == j2 - j1:
+            continue
+        return None
+    return zip(prev_doc.sections, current_doc.sections)
+
+
+def preamble_document(doc):
+    """A minimal document holding just the preamble of `doc`, for diffing
+    the preambles.
+    """
+    return doc.preamble + u"\n\\end{document}\n"
+
+
+def stitch(preamble_diff, section_diffs, postamble):
+    """Stitch diffed chunks into a single document.
+
+    Parameters
+    ----------
+    preamble_diff : unicode
+        latexdiff output for the documents made by :func:`preamble_document`;
+        provides the (single) preamble with latexdiff's definitions.
+    section_diffs : list
+        latexdiff output for each pair of sections.
+    postamble : unicode
+        Text from ``\\end{document}`` onwards.
+    """
+    end = end_document_pattern.search(preamble_diff)
+    if end is not None:
+        # The front matter carries its own leading whitespace
+        preamble_diff = preamble_diff[:end.start()].rstrip()
+    return preamble_diff + u"".join(section_diffs) + postamble
@@ -41,7 +41,11 @@ class Configurations(object):
     _DEFAULTS = {
         "master": "paper.tex",
         "exts": ["tex", "pdf", "eps"],
-        "cmd": "latexmk -f -pdf -bibtex-cond {master}"}
+        "cmd": "latexmk -f -pdf -bibtex-cond {master}",
+        "delay": 0.5,
+        "scratch_dir": None,
+        "diff_engine": "latexdiff",
+        "diff_exclude": []}
 
     def __init__(self):
         super(Configurations, self).__init__()
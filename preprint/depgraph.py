@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Discover the local files that a LaTeX document depends upon.
+
+Starting from the master document, :func:`find_dependencies` follows
+``\\input``, ``\\include`` and ``\\InputIfFileExists`` recursively and collects
+graphics (``\\includegraphics``, and AASTeX's ``\\plotone``/``\\plottwo``),
+bibliographies, and any ``.sty``/``.cls``/``.bst`` files that live in the
+project rather than in the TeX distribution.
+"""
+
+import os
+import re
+import codecs
+import logging
+
+
+log = logging.getLogger(__name__)
+
+GRAPHICS_EXTS = ('pdf', 'eps', 'ps', 'png', 'jpg', 'jpeg')
+
+comment_pattern = re.compile(ur"(?<!\\)%.*$", re.UNICODE | re.MULTILINE)
+input_pattern = re.compile(
+    ur"\\(?:input|include|InputIfFileExists)\s*{(.*?)}", re.UNICODE)
+graphics_pattern = re.compile(
+    ur"\\includegraphics\*?\s*(?:\[.*?\])?\s*{(.*?)}", re.UNICODE)
+plot_pattern = re.compile(
+    ur"\\plot(?:one|two)\s*{(.*?)}(?:\s*{(.*?)})?", re.UNICODE)
+graphicspath_pattern = re.compile(
+    ur"\\graphicspath\s*{((?:\s*{.*?})*)\s*}", re.UNICODE)
+bibliography_pattern = re.compile(
+    ur"\\(?:bibliography|addbibresource)\s*(?:\[.*?\])?\s*{(.*?)}",
+    re.UNICODE)
+bibstyle_pattern = re.compile(ur"\\bibliographystyle\s*{(.*?)}", re.UNICODE)
+package_pattern = re.compile(
+    ur"\\(?:usepackage|RequirePackage)\s*(?:\[.*?\])?\s*{(.*?)}",
+    re.UNICODE | re.DOTALL)
+class_pattern = re.compile(
+    ur"\\documentclass\s*(?:\[.*?\])?\s*{(.*?)}", re.UNICODE | re.DOTALL)
+
+
+class Dependencies(object):
+    """The local files a document depends upon.
+
+    Attributes
+    ----------
+    files : set
+        Absolute paths of dependencies that exist.
+    missing : set
+        Absolute paths of dependencies that are referenced by the document
+        but do not exist (yet).
+    """
+
+    def __init__(self, files=None, missing=None):
+        super(Dependencies, self).__init__()
+        self.files = set(files or [])
+        self.missing = set(missing or [])
+
+    def __contains__(self, path):
+        path = os.path.abspath(path)
+        return path in self.files or path in self.missing
+
+    @property
+    def directories(self):
+        """Set of existing directories holding (possible) dependencies."""
+        dirs = set()
+        for path in self.files | self.missing:
+            dirname = os.path.dirname(path)
+            if os.path.isdir(dirname):
+                dirs.add(dirname)
+        return dirs
+
+
+class LocalFiles(object):
+    """Access to files on the local file system."""
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def read_text(self, path):
+        with codecs.open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+
+
+def find_dependencies(master_path, graphics_exts=GRAPHICS_EXTS, files=None):
+    """Build the set of local files that a LaTeX document depends upon.
+
+    Parameters
+    ----------
+    master_path : str
+        Path to the root tex document.
+    graphics_exts : list
+        Extensions, in order of priority, to try for ``\\includegraphics``
+        paths that are given without an extension.
+    files : object
+        Source of the files, with ``exists(path)`` and ``read_text(path)``
+        methods. Defaults to the local file system (:class:`LocalFiles`);
+        pass a :class:`preprint.gitobjects.TreeFiles` to find the
+        dependencies of a git revision.
+
+    Returns
+    -------
+    deps : :class:`Dependencies`
+        The document's dependencies, including `master_path` itself.
+    """
+    if files is None:
+        files = LocalFiles()
+    base_dir = os.path.dirname(os.path.abspath(master_path))
+    deps = Dependencies()
+    graphics_dirs = [base_dir]
+    pending = [os.path.abspath(master_path)]
+    visited = set()
+    while pending:
+        tex_path = pending.pop()
+        if tex_path in visited:
+            continue
+        visited.add(tex_path)
+        if not files.exists(tex_path):
+            deps.missing.add(tex_path)
+            continue
+        deps.files.add(tex_path)
+        tex = comment_pattern.sub(u"", files.read_text(tex_path))
+
+        for name in input_pattern.findall(tex):
+            pending.append(_local_path(base_dir, name, 'tex'))
+
+        for paths in graphicspath_pattern.findall(tex):
+            for p in re.findall(ur"{(.*?)}", paths):
+                graphics_dirs.append(os.path.join(base_dir, p))
+        fig_names = graphics_pattern.findall(tex)
+        for names in plot_pattern.findall(tex):
+            fig_names.extend(n for n in names if n)
+        for name in fig_names:
+            _add_graphic(deps, graphics_dirs, name.strip(), graphics_exts,
+                         files)
+
+        for names in bibliography_pattern.findall(tex):
+            for name in _split_names(names):
+                _add(deps, _local_path(base_dir, name, 'bib'), files)
+        for names in bibstyle_pattern.findall(tex):
+            _add_if_local(deps, _local_path(base_dir, names.strip(), 'bst'),
+                          files)
+        for names in package_pattern.findall(tex):
+            for name in _split_names(names):
+                _add_if_local(deps, _local_path(base_dir, name, 'sty'), files)
+        for name in class_pattern.findall(tex):
+            _add_if_local(deps, _local_path(base_dir, name.strip(), 'cls'),
+                          files)
+    log.debug("Found {0:d} dependencies ({1:d} missing) of {2}".format(
+        len(deps.files), len(deps.missing), master_path))
+    return deps
+
+
+def _split_names(names):
+    """Split a comma-separated list of names."""
+    return [n.strip() for n in names.split(u",") if n.strip()]
+
+
+def _local_path(base_dir, name, ext):
+    """Absolute path of `name` relative to `base_dir`, adding `ext` if the
+    name does not already have it.
+    """
+    if not name.endswith("." + ext):
+        name = ".".join((name, ext))
+    return os.path.abspath(os.path.join(base_dir, name))
+
+
+def _add(deps, path, files):
+    """Add `path` as an existing or missing dependency."""
+    if files.exists(path):
+        deps.files.add(path)
+    else:
+        deps.missing.add(path)
+
+
+def _add_if_local(deps, path, files):
+    """Add `path` only if it exists (otherwise it is part of the TeX
+    distribution).
+    """
+    if files.exists(path):
+        deps.files.add(path)
+
+
+def _add_graphic(deps, graphics_dirs, name, graphics_exts, files):
+    """Add the files that may satisfy an ``\\includegraphics{name}``."""
+    has_ext = os.path.splitext(name)[-1].lstrip('.').lower() \
+        in graphics_exts
+    candidates = []
+    for _dir in graphics_dirs:
+        base = os.path.abspath(os.path.join(_dir, name))
+        if has_ext:
+            candidates.append(base)
+        else:
+            candidates.extend(".".join((base, ext)) for ext in graphics_exts)
+    found = [p for p in candidates if files.exists(p)]
+    if found:
+        deps.files.update(found)
+    else:
+        deps.missing.update(candidates)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Exclude environments (such as large tables, ``align`` blocks and verbatim
+listings) from the diff.
+
+Before diffing, each excluded environment is replaced by a placeholder
+command that names its content by hash. The diff engine then only sees a
+single token for the environment, so identical environments match and
+changed ones show up as a deleted and an added placeholder. Afterwards the
+placeholders are replaced by the original environments: unchanged
+environments as they are, added or changed environments with a coarse
+``[changed]`` marker, and deleted environments commented out.
+"""
+
+import re
+import hashlib
+
+
+CHANGED_MARKER = u"\\DIFaddbegin \\DIFadd{[changed]}\\DIFaddend "
+
+placeholder_pattern = re.compile(ur"\\PREPRINTEXCLUDED{(?P<key>[0-9a-f]+)}",
+                                 re.UNICODE)
+comment_pattern = re.compile(ur"(?<!\\)%", re.UNICODE)
+
+
+def mask_environments(tex, environments):
+    """Replace environments in a document with placeholders.
+
+    Parameters
+    ----------
+    tex : unicode
+        Text of the document.
+    environments : list
+        Names of the environments to exclude (such as ``"table"``). Nested
+        environments are excluded along with their outermost environment.
+
+    Returns
+    -------
+    masked_tex : unicode
+        The document with placeholders.
+    regions : dict
+        Mapping of placeholder keys to the text of the environments.
+    """
+    if not environments:
+        return tex, {}
+    begin_pattern = re.compile(
+        ur"\\begin\s*{(" + u"|".join(re.escape(e) for e in environments)
+        + ur")}", re.UNICODE)
+    parts = []
+    regions = {}
+    i = 0
+    while True:
+        begin = begin_pattern.search(tex, i)
+        if begin is None:
+            break
+        end = _environment_end(tex, begin)
+        if end is None:
+            # Unterminated environment; leave it to the diff
+            break
+        region = tex[begin.start():end]
+        key = hashlib.sha1(region.encode('utf-8')).hexdigest()[:16]
+        regions[key] = region
+        parts.append(tex[i:begin.start()])
+        parts.append(u"\\PREPRINTEXCLUDED{" + key + u"}")
+        i = end
+    parts.append(tex[i:])
+    return u"".join(parts), regions
+
+
+def _environment_end(tex, begin):
+    """Index just past the ``\\end`` matching the ``\\begin`` match `begin`,
+    or `None` if the environment is not terminated.
+    """
+    name = re.escape(begin.group(1))
+    pattern = re.compile(ur"\\(begin|end)\s*{" + name + ur"}", re.UNICODE)
+    depth = 1
+    for m in pattern.finditer(tex, begin.end()):
+        depth += 1 if m.group(1) == u"begin" else -1
+        if depth == 0:
+            return m.end()
+    return None
+
+
+def restore_environments(diff_tex, prev_regions, current_regions):
+    """Replace the placeholders in a difference document with the excluded
+    environments.
+
+    Parameters
+    ----------
+    diff_tex : unicode
+        The difference document.
+    prev_regions : dict
+        Excluded regions of the previous document, from
+        :func:`mask_environments`.
+    current_regions : dict
+        Excluded regions of the current document.
+
+    Returns
+    -------
+    diff_tex : unicode
+        The difference document with the environments restored.
+    """
+    lines = diff_tex.split(u"\n")
+    for n, line in enumerate(lines):
+        if u"\\PREPRINTEXCLUDED" not in line:
+            continue
+        lines[n] = placeholder_pattern.sub(
+            lambda m: _restore(m, prev_regions, current_regions), line)
+    return u"\n".join(lines)
+
+
+def _restore(m, prev_regions, current_regions):
+    """Text of the excluded region for a placeholder match `m`."""
+    key = m.group('key')
+    if comment_pattern.search(m.string, 0, m.start()):
+        # Deleted by the diff: comment out the whole environment
+        region = prev_regions.get(key)
+        if region is None:
+            return m.group()
+        return region.replace(u"\n", u"\n%DIFDELCMD < ")
+    if key in current_regions:
+        region = current_regions[key]
+        if key in prev_regions:
+            return region
+        return CHANGED_MARKER + region
+    return m.group()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Content hashing of files, with a cache that uses each file's modification
+time and size as a cheap first check.
+"""
+
+import os
+import hashlib
+import threading
+
+
+def file_digest(path, algorithm='sha1', blocksize=1 << 16):
+    """Hex digest of the content of the file at `path`."""
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+class FileHashCache(object):
+    """Track the content hashes of files to detect real content changes.
+
+    A file is only re-hashed if its modification time or size changed since
+    it was last seen, so repeated checks of unchanged files cost a single
+    ``stat``.
+    """
+
+    def __init__(self):
+        super(FileHashCache, self).__init__()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def prime(self, paths):
+        """Record the current state of those `paths` that are not known yet,
+        so that their first event only counts as a change if their content
+        changed.
+
+        Paths that are already known are left alone, so that a change that
+        has not been reported yet is not lost.
+        """
+        for path in paths:
+            if self.digest(path) is None:
+                self.update(path)
+
+    def update(self, path):
+        """Record the current state of the file at `path`.
+
+        Returns
+        -------
+        changed : bool
+            `True` if the file's content differs from when it was last seen
+            (including if the file is new to the cache, or was deleted).
+        """
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                return self._entries.pop(path, None) is not None
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[:2] == (st.st_mtime, st.st_size):
+            return False
+        try:
+            digest = file_digest(path)
+        except IOError:
+            # File vanished between stat and read
+            with self._lock:
+                return self._entries.pop(path, None) is not None
+        with self._lock:
+            self._entries[path] = (st.st_mtime, st.st_size, digest)
+        return entry is None or entry[2] != digest
+
+    def digest(self, path):
+        """Cached content digest of `path`, or `None` if it is unknown."""
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        return entry[2]
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Fast access to git objects through a long-lived ``git cat-file --batch``
+process.
+
+Reading an old revision file-by-file with ``git show`` costs a process
+start-up per file. A :class:`GitObjectReader` instead keeps a single
+``git cat-file --batch`` process per repository, and lists the tree of a
+revision once, so that every blob lookup is a round-trip over a pipe.
+"""
+
+import os
+import re
+import atexit
+import bisect
+import posixpath
+import subprocess
+import threading
+import logging
+
+from .cache import TextCache, CACHE_DIR
+
+
+log = logging.getLogger(__name__)
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+sha_pattern = re.compile(r"^[0-9a-fA-F]{4,40}$")
+
+
+class GitObjectError(Exception):
+    """Raised when a git object cannot be found."""
+    pass
+
+
+def get_resolver(repo_dir="."):
+    """Get a :class:`CommitResolver` for the repository containing
+    `repo_dir`, sharing its :class:`GitObjectReader`.
+    """
+    return CommitResolver(get_reader(repo_dir))
+
+
+def get_reader(repo_dir="."):
+    """Get the shared :class:`GitObjectReader` for the repository containing
+    `repo_dir`.
+    """
+    git_root = git_toplevel(repo_dir)
+    with _readers_lock:
+        reader = _readers.get(git_root)
+        # Readers inherited by forked worker processes must not share the
+        # parent's pipes
+        if reader is None or reader.closed or reader.pid != os.getpid():
+            reader = GitObjectReader(git_root)
+            _readers[git_root] = reader
+    return reader
+
+
+def git_toplevel(path="."):
+    """Absolute path of the root of the git work tree containing `path`."""
+    if not os.path.isdir(path):
+        path = os.path.dirname(os.path.abspath(path))
+    root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
+                                   cwd=path)
+    return os.path.abspath(root.strip())
+
+
+def is_sha(ref, repo_dir="."):
+    """`True` if `ref` is a (possibly abbreviated) commit SHA, which never
+    moves, rather than the name of a branch, tag or other ref that happens
+    to look like one (such as ``cafe``).
+    """
+    if not sha_pattern.match(ref):
+        return False
+    # Refs take precedence over SHAs, and only refs have a symbolic name
+    proc = subprocess.Popen(
+        ['git', 'rev-parse', '--verify', '-q', '--symbolic-full-name', ref],
+        cwd=repo_dir, stdout=subprocess.PIPE)
+    name = proc.communicate()[0].strip()
+    return proc.returncode == 0 and not name
+
+
+class GitObjectReader(object):
+    """Read objects from a git repository over one ``git cat-file --batch``
+    process.
+
+    Parameters
+    ----------
+    repo_dir : str
+        Path to the root of the git work tree.
+    """
+
+    def __init__(self, repo_dir="."):
+        super(GitObjectReader, self).__init__()
+        self.repo_dir = os.path.abspath(repo_dir)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._trees = {}
+        self._proc = subprocess.Popen(
+            ['git', 'cat-file', '--batch'], cwd=self.repo_dir,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        atexit.register(self.close)
+
+    @property
+    def closed(self):
+        """`True` if the ``git cat-file`` process is no longer running."""
+        return self._proc is None or self._proc.poll() is not None
+
+    def close(self):
+        """Stop the ``git cat-file`` process."""
+        if self._proc is None:
+            return
+        with self._lock:
+            proc, self._proc = self._proc, None
+            if proc.poll() is None:
+                proc.stdin.close()
+                # Forked processes may hold copies of the pipe, so don't rely
+                # on cat-file seeing the end of its input
+                proc.terminate()
+                proc.wait()
+
+    def read_object(self, name):
+        """Read a git object.
+
+        Parameters
+        ----------
+        name : str
+            Any object name understood by ``git cat-file``, such as a SHA or
+            ``<rev>:<path>``.
+
+        Returns
+        -------
+        sha : str
+            Full SHA of the object.
+        obj_type : str
+            Type of the object (``blob``, ``tree``, ``commit`` or ``tag``).
+        content : bytes
+            Raw content of the object.
+        """
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        with self._lock:
+            if self._proc is None:
+                raise GitObjectError("Reader for {0} is closed".format(
+                    self.repo_dir))
+            self._proc.stdin.write(name + b"\n")
+            self._proc.stdin.flush()
+            header = self._proc.stdout.readline().split()
+            if len(header) != 3:
+                raise GitObjectError("{0} not found in {1}".format(
+                    name, self.repo_dir))
+            sha, obj_type, size = header
+            content = self._proc.stdout.read(int(size))
+            # Consume the newline that terminates the object
+            self._proc.stdout.read(1)
+        return sha, obj_type, content
+
+    def resolve(self, commit_ref):
+        """Full SHA of the commit `commit_ref` refers to."""
+        return self.read_object(commit_ref + "^{commit}")[0]
+
+    def tree(self, commit_ref):
+        """Listing of all blobs in the tree of a commit.
+
+        The listing is read once per commit with ``git ls-tree`` and cached.
+
+        Returns
+        -------
+        tree : dict
+            Mapping of repository-relative (POSIX) paths to blob SHAs.
+        """
+        sha = self.resolve(commit_ref)
+        if sha not in self._trees:
+            listing = subprocess.check_output(
+                ['git', 'ls-tree', '-r', '-z', '--full-tree', sha],
+                cwd=self.repo_dir)
+            tree = {}
+            for entry in listing.split(b"\0"):
+                if not entry:
+                    continue
+                meta, path = entry.split(b"\t", 1)
+                mode, obj_type, blob_sha = meta.split()
+                if obj_type == b"blob":
+                    tree[path.decode('utf-8')] = blob_sha
+            self._trees[sha] = tree
+        return self._trees[sha]
+
+    def has_blob(self, commit_ref, path):
+        """`True` if the file at `path` exists in the commit's tree."""
+        return normalize_path(path) in self.tree(commit_ref)
+
+    def read_blob(self, commit_ref, path):
+        """Read the bytes of the file at repository-relative `path` in the
+        tree of a commit.
+        """
+        tree = self.tree(commit_ref)
+        try:
+            blob_sha = tree[normalize_path(path)]
+        except KeyError:
+            raise GitObjectError("{0} not found in {1}".format(
+                path, commit_ref))
+        return self.read_object(blob_sha)[2]
+
+    def read_text(self, commit_ref, path, encoding='utf-8'):
+        """Read the file at `path` in the tree of a commit as unicode."""
+        return self.read_blob(commit_ref, path).decode(encoding)
+
+
+class TreeFiles(object):
+    """Read-only view of the tree of a commit, addressed by the paths the
+    files would have in the work tree.
+
+    This lets code written for the file system (such as
+    :func:`preprint.depgraph.find_dependencies`) read a revision directly
+    from git objects.
+
+    Parameters
+    ----------
+    reader : :class:`GitObjectReader`
+        Reader for the repository.
+    commit_ref : str
+        Commit reference string.
+    """
+
+    def __init__(self, reader, commit_ref):
+        super(TreeFiles, self).__init__()
+        self._reader = reader
+        self.commit = reader.resolve(commit_ref)
+
+    def tree_path(self, path):
+        """Repository-relative path of the work tree path `path`."""
+        return normalize_path(os.path.relpath(
+            os.path.realpath(path), os.path.realpath(self._reader.repo_dir)))
+
+    def exists(self, path):
+        """`True` if the file at `path` exists in the commit."""
+        return self.tree_path(path) in self._reader.tree(self.commit)
+
+    def blob_sha(self, path):
+        """SHA of the blob at `path`, or `None` if it does not exist."""
+        return self._reader.tree(self.commit).get(self.tree_path(path))
+
+    def read_bytes(self, path):
+        """Read the file at `path` from the commit."""
+        return self._reader.read_blob(self.commit, self.tree_path(path))
+
+    def read_text(self, path, encoding='utf-8'):
+        """Read the file at `path` from the commit as unicode."""
+        return self.read_bytes(path).decode(encoding, 'replace')
+
+
+def normalize_path(path):
+    """Normalize a repository-relative path to git's POSIX form."""
+    path = path.replace(os.sep, "/")
+    if isinstance(path, bytes):
+        path = path.decode('utf-8')
+    return posixpath.normpath(path)
+
+
+class CommitResolver(object):
+    """Resolve and count commits without walking the whole history.
+
+    References (SHA fragments, tags, branches, ``HEAD``) are resolved by
+    git's own revision parser over the reader's ``cat-file`` channel, and
+    commits are counted with ``git rev-list --count``. For matching SHA
+    prefixes against the history, a sorted index of the SHAs reachable from
+    ``HEAD`` is built once and cached on disk, keyed by the SHA of ``HEAD``.
+
+    Parameters
+    ----------
+    reader : :class:`GitObjectReader`
+        Reader for the repository.
+    cache : :class:`preprint.cache.TextCache`
+        Cache for the SHA index. Defaults to the ``commits`` cache in the
+        repository's ``.preprint-cache/`` directory.
+    """
+
+    def __init__(self, reader, cache=None):
+        super(CommitResolver, self).__init__()
+        self._reader = reader
+        if cache is None:
+            cache = TextCache('commits', cache_dir=os.path.join(
+                reader.repo_dir, CACHE_DIR))
+        self._cache = cache
+        self._index_head = None
+        self._sorted = []
+        self._order = {}
+
+    def resolve(self, commit_ref):
+        """Full SHA of the commit `commit_ref` refers to, or `None`."""
+        try:
+            return self._reader.resolve(commit_ref)
+        except GitObjectError:
+            return None
+
+    def count(self, commit_ref='HEAD'):
+        """Number of commits reachable from `commit_ref`."""
+        n = subprocess.check_output(['git', 'rev-list', '--count',
+                                     commit_ref], cwd=self._reader.repo_dir)
+        return int(n)
+
+    def rev_range(self, range_spec):
+        """SHAs of the commits in a ``A..B`` range, oldest first.
+
+        Only first-parent history is followed, so that each commit in the
+        range is paired with the revision it was made on top of.
+        """
+        text = subprocess.check_output(
+            ['git', 'rev-list', '--reverse', '--first-parent', range_spec],
+            cwd=self._reader.repo_dir)
+        return text.decode('ascii').split()
+
+    def history(self):
+        """SHAs of all commits reachable from ``HEAD``, newest first."""
+        self._load_index()
+        return sorted(self._order, key=self._order.get)
+
+    def match(self, sha_prefix):
+        """Match a SHA fragment to a commit in the history of ``HEAD``.
+
+        If the fragment is ambiguous, the most recent matching commit is
+        returned, or `None` if no commit matches.
+        """
+        self._load_index()
+        sha_prefix = sha_prefix.lower()
+        i = bisect.bisect_left(self._sorted, sha_prefix)
+        matches = []
+        while i < len(self._sorted) and \
+                self._sorted[i].startswith(sha_prefix):
+            matches.append(self._sorted[i])
+            i += 1
+        if not matches:
+            return None
+        return min(matches, key=self._order.get)
+
+    def _load_index(self):
+        """Load the SHA index for the current ``HEAD``."""
+        head = self.resolve('HEAD')
+        if head == self._index_head:
+            return
+        if head is None:
+            # No commits yet
+            self._order, self._sorted = {}, []
+            self._index_head = head
+            return
+        text = self._cache.get(head)
+        if text is None:
+            text = subprocess.check_output(['git', 'rev-list', head],
+                                           cwd=self._reader.repo_dir)
+            text = text.decode('ascii')
+            self._cache.put(head, text)
+        shas = text.split()
+        self._order = dict((sha, i) for i, sha in enumerate(shas))
+        self._sorted = sorted(shas)
+        self._index_head = head
@@ -6,19 +6,54 @@ Command for running latexdiff.
 
 import logging
 import os
+import re
+import time
 import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import codecs
 import shutil
+import posixpath
+import binascii
+import filecmp
 import git
 
-from paperweight.texutils import inline, inline_blob, remove_comments
-from paperweight.gitio import read_git_blob, absolute_git_root_dir
+from paperweight.texutils import remove_comments
+from paperweight.gitio import absolute_git_root_dir
 
 from cliff.command import Command
 
+from .cache import TextCache, cache_key, CACHE_DIR
+from .gitobjects import get_reader, get_resolver, GitObjectError, \
+    TreeFiles
+from .scratch import make_scratch_dir, tex_env
+from .filehash import file_digest
+from .chunkdiff import split_document, align_sections, preamble_document, \
+    stitch
+from .worddiff import diff_tex
+from .exclude import mask_environments, restore_environments
+from .depgraph import GRAPHICS_EXTS
+from .revbuild import input_closure
+
+
+LATEXDIFF_OPTIONS = "--type=CTRADITIONAL"
+# Files that builds of a historical revision read from its git tree
+TREE_FILE_EXTS = GRAPHICS_EXTS + ('bbl', 'bib', 'bst', 'sty', 'cls')
+ENGINES = ("latexdiff", "python")
+# Version of the inlined text format; bump it when the inliner changes so
+# that inlined revisions cached by older versions are not used
+INLINE_VERSION = "2"
+
+# \InputIfFileExists{name}{then}{else} (the then/else code may hold one
+# level of braces), or \input{name} and \include{name}
+input_pattern = re.compile(
+    ur"\\InputIfFileExists\s*{(.*?)}"
+    ur"\s*{((?:[^{}]|{[^{}]*})*)}\s*{((?:[^{}]|{[^{}]*})*)}"
+    ur"|\\(?:input|include)\s*{(.*?)}", re.UNICODE)
+
 
 class Diff(Command):
-    """Run latexdiff between HEAD and a git ref."""
+    """Run latexdiff between HEAD and one or more git refs."""
 
     log = logging.getLogger(__name__)
 
@@ -26,72 +61,654 @@ class Diff(Command):
         parser = super(Diff, self).get_parser(prog_name)
         parser.add_argument(
             'prev_commit',
-            help="Commit SHA to compare HEAD against.")
+            nargs='?',
+            default=None,
+            help="Commit SHA to compare HEAD against, or a range A..B to "
+                 "diff each pair of consecutive commits.")
+        parser.add_argument(
+            'current_commit',
+            nargs='?',
+            default=None,
+            help="Commit SHA to compare against instead of the working "
+                 "tree.")
+        parser.add_argument(
+            '-r', '--ref',
+            dest='refs',
+            action='append',
+            default=[],
+            help="Additional commit SHA or A..B range to diff against "
+                 "(can be repeated).")
         parser.add_argument(
             '-n', '--name',
             default=None,
             help="Name of the difference file.")
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Number of difference documents to build in parallel.")
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            default=False,
+            help="Keep LaTeX's auxiliary files between runs so that later "
+                 "diffs compile incrementally.")
+        parser.add_argument(
+            '--clean',
+            action='store_true',
+            default=False,
+            help="Delete the kept auxiliary files of these diffs.")
+        parser.add_argument(
+            '--chunked',
+            action='store_true',
+            default=False,
+            help="Run latexdiff section by section, in parallel.")
+        parser.add_argument(
+            '--engine',
+            choices=ENGINES,
+            default=self.app.confs.config('diff_engine'),
+            help="Diff with the external latexdiff tool or the built-in "
+                 "python engine.")
+        parser.add_argument(
+            '--exclude',
+            nargs='*',
+            default=self.app.confs.config('diff_exclude'),
+            help="Environments to leave out of the diff; they are only "
+                 "marked if they changed.")
         return parser
 
     def take_action(self, parsed_args):
-        # Inline current and previous versions of the document
-        if parsed_args.name is None:
-            name = "current_{0}".format(parsed_args.prev_commit)
+        refs = list(parsed_args.refs)
+        if parsed_args.prev_commit is not None:
+            refs.insert(0, parsed_args.prev_commit)
+        if not refs:
+            raise ValueError("Give at least one git ref to diff against.")
+
+        jobs = diff_jobs(refs, self.app.options.master, name=parsed_args.name,
+                         current_commit=parsed_args.current_commit)
+        if parsed_args.clean:
+            for output_name, prev_commit, current_commit in jobs:
+                build_dir = kept_build_dir(output_name)
+                if os.path.exists(build_dir):
+                    self.log.info("Deleting {0}".format(build_dir))
+                    shutil.rmtree(build_dir)
+            return
+
+        scratch_root = self.app.confs.config('scratch_dir')
+        tasks = []
+        for output_name, prev_commit, current_commit in jobs:
+            if parsed_args.keep:
+                build_dir = kept_build_dir(output_name)
+            else:
+                build_dir = None
+            tasks.append((output_name, self.app.options.master, prev_commit,
+                          current_commit, scratch_root, build_dir,
+                          parsed_args.chunked, parsed_args.engine,
+                          parsed_args.exclude))
+
+        start = time.time()
+        n_procs = max(1, min(parsed_args.jobs, len(tasks)))
+        if n_procs == 1:
+            results = [_run_diff_task(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(n_procs)
+            try:
+                results = pool.map_async(_run_diff_task, tasks).get(1e9)
+            finally:
+                pool.terminate()
+                pool.join()
+        n_failed = 0
+        for output_name, elapsed, error in results:
+            if error is None:
+                self.log.info("{0}: built in {1:.1f} s".format(
+                    output_name, elapsed))
+            else:
+                n_failed += 1
+                self.log.error("{0}: failed after {1:.1f} s ({2})".format(
+                    output_name, elapsed, error))
+        self.log.info("Built {0:d} difference document(s) in {1:.1f} s".format(
+            len(results) - n_failed, time.time() - start))
+        if n_failed:
+            # cliff reports the error and exits with a non-zero status
+            raise RuntimeError("{0:d} of {1:d} difference document(s) "
+                               "failed".format(n_failed, len(results)))
+
+
+def diff_jobs(refs, master_path, name=None, current_commit=None):
+    """Expand git refs and ``A..B`` ranges into difference jobs.
+
+    A plain ref is compared against the working tree (or `current_commit`).
+    A range ``A..B`` yields a job for each pair of consecutive commits from
+    ``A`` to ``B``.
+
+    Parameters
+    ----------
+    refs : list
+        Git refs and ranges.
+    master_path : str
+        Path to the root tex document in the filesystem.
+    name : str
+        Name of the difference document. If several documents are built,
+        this is used as a prefix of each name.
+    current_commit : str
+        Commit to compare plain refs against, instead of the working tree.
+
+    Returns
+    -------
+    jobs : list
+        List of ``(output_name, prev_commit, current_commit)`` tuples, where
+        `current_commit` is `None` for the working tree.
+    """
+    jobs = []
+    for ref in refs:
+        if ".." in ref:
+            resolver = get_resolver(master_path)
+            start = ref.split("..")[0] or "HEAD"
+            commits = resolver.rev_range(ref)
+            prev_commits = [resolver.resolve(start)] + commits[:-1]
+            for prev_commit, current_commit in zip(prev_commits, commits):
+                jobs.append(("{0}_{1}".format(prev_commit[:7],
+                                              current_commit[:7]),
+                             prev_commit, current_commit))
+        elif current_commit is None:
+            jobs.append(("current_{0}".format(ref.replace("/", "-")),
+                         ref, None))
+        else:
+            jobs.append(("{0}_{1}".format(ref.replace("/", "-"),
+                                          current_commit.replace("/", "-")),
+                         ref, current_commit))
+    if name is not None:
+        if len(jobs) == 1:
+            jobs = [(name, jobs[0][1], jobs[0][2])]
+        else:
+            jobs = [("{0}_{1}".format(name, output_name), prev, current)
+                    for output_name, prev, current in jobs]
+    return jobs
+
+
+def kept_build_dir(output_name):
+    """Path of the persistent build directory of a difference document."""
+    return os.path.join(CACHE_DIR, "builds", output_name)
+
+
+def _run_diff_task(task):
+    """Run a :func:`git_diff_pipeline` job, in a worker process.
+
+    Returns
+    -------
+    output_name : str
+        Name of the difference document.
+    elapsed : float
+        Time taken by the job, in seconds.
+    error : str
+        Description of the error if the job failed, or `None`.
+    """
+    (output_name, master_path, prev_commit, current_commit, scratch_root,
+     build_dir, chunked, engine, exclude) = task
+    start = time.time()
+    try:
+        git_diff_pipeline(output_name, master_path, prev_commit,
+                          current_commit=current_commit,
+                          prev_cache=TextCache('revisions'),
+                          diff_cache=TextCache('latexdiff'),
+                          scratch_root=scratch_root,
+                          build_dir=build_dir,
+                          chunked=chunked,
+                          engine=engine,
+                          exclude=exclude)
+    except Exception as e:
+        return output_name, time.time() - start, \
+            "{0}: {1}".format(e.__class__.__name__, e)
+    return output_name, time.time() - start, None
+
+
+def git_diff_pipeline(output_name, master_path, prev_commit,
+                      current_commit=None, supervisor=None, prev_cache=None,
+                      diff_cache=None, scratch_root=None, build_dir=None,
+                      chunked=False, engine="latexdiff", exclude=None,
+                      background=None):
+    """Pipeline for typesetting latexdiff against a commit in git history.
+
+    The pipeline runs in its own private scratch directory, so several
+    pipelines can run concurrently. Only the final PDF is moved into the
+    ``build/`` directory.
+
+    Alternatively the pipeline can run in a persistent `build_dir` that
+    keeps LaTeX's auxiliary files (``.aux``, ``.bbl``, ``.fls``...) between
+    runs. ``latexmk`` can then recompile incrementally, typically with a
+    single LaTeX pass.
+
+    The current and previous documents are inlined concurrently, and the
+    time spent in each stage is logged.
+
+    Parameters
+    ----------
+    output_name : str
+        Name of the difference document.
+    master_path : str
+        Path to the root tex document in the filesystem.
+    prev_commit : str
+        Commit reference string of the previous version.
+    current_commit : str
+        Commit reference string of the current version, or `None` to use
+        the working tree. A historical current version is built entirely
+        from its git tree (see :func:`materialize_revision`), without
+        reading the working tree.
+    supervisor : :class:`preprint.supervisor.BuildSupervisor`
+        Optional supervisor that runs the ``latexdiff`` and ``latexmk``
+        commands so the pipeline can be cancelled. A cancelled pipeline
+        raises :class:`preprint.supervisor.BuildCancelled`.
+    prev_cache : :class:`preprint.cache.TextCache`
+        Optional cache of inlined git revisions (see :func:`inline_prev`).
+    diff_cache : :class:`preprint.cache.TextCache`
+        Optional cache of ``latexdiff`` output, keyed by the content of both
+        inlined documents and the ``latexdiff`` options. Rebuilds where the
+        text did not change (say, after editing a figure) skip ``latexdiff``.
+    scratch_root : str
+        Directory in which to create the scratch directory (for example, a
+        tmpfs such as ``/dev/shm``). Defaults to the system's temporary
+        directory.
+    build_dir : str
+        Optional persistent build directory, used instead of a scratch
+        directory. It is not deleted by the pipeline.
+    chunked : bool
+        If `True`, run ``latexdiff`` section by section, in parallel (see
+        :func:`run_chunked_latexdiff`).
+    engine : str
+        Diff engine: ``"latexdiff"`` runs the external ``latexdiff`` tool,
+        while ``"python"`` uses the built-in :mod:`preprint.worddiff`.
+    exclude : list
+        Names of environments to leave out of the diff (see
+        :func:`run_latexdiff`).
+    background : :class:`BackgroundWorker`
+        Optional worker that publishes the PDF and cleans up after the
+        build in the background, instead of blocking the caller.
+    """
+    log = logging.getLogger(__name__)
+    if supervisor is None:
+        call = _shell_call
+    else:
+        call = supervisor.call
+
+    if build_dir is None:
+        work_dir = make_scratch_dir(prefix="preprint-diff-",
+                                    root=scratch_root)
+    else:
+        work_dir = os.path.abspath(build_dir)
+        _makedirs(work_dir)
+    log.debug("work_dir {0}".format(work_dir))
+    timings = []
+    submitted = False
+    try:
+        # The current document comes from the working tree and the previous
+        # one from git objects, so inline them side by side
+        inliner = ThreadPool(1)
+        try:
+            prev_result = inliner.apply_async(
+                _timed_call, (timings, "inline prev", inline_prev,
+                              prev_commit, master_path),
+                dict(cache=prev_cache, output_dir=work_dir))
+            if current_commit is None:
+                current_path = _timed_call(
+                    timings, "inline current", inline_current, master_path,
+                    output_dir=work_dir)
+            else:
+                current_path = _timed_call(
+                    timings, "inline current", inline_prev, current_commit,
+                    master_path, cache=prev_cache, output_dir=work_dir,
+                    filename="_current.tex")
+            prev_path = prev_result.get()
+        finally:
+            inliner.close()
+            inliner.join()
+        log.debug("current_path {0}".format(current_path))
+        log.debug("prev_path {0}".format(prev_path))
+        if current_commit is None:
+            tex_dirs = [os.getcwd()]
+        else:
+            # Build only from the commit's tree, not the working tree
+            _timed_call(timings, "materialize", materialize_revision,
+                        current_commit, master_path, work_dir)
+            tex_dirs = [work_dir]
+
+        # Run latexdiff
+        diff_name = os.path.basename(os.path.splitext(output_name)[0])
+        if current_commit is not None:
+            _copy_bbl(master_path, work_dir, diff_name)
+        _timed_call(timings, "diff", run_latexdiff, prev_path, current_path,
+                    os.path.join(work_dir, "_diff.tex"), call=call,
+                    cache=diff_cache, chunked=chunked, engine=engine,
+                    exclude=exclude)
+        # Only replace the diff document if it changed, so latexmk can tell
+        # when nothing needs to be rebuilt
+        _replace_if_changed(os.path.join(work_dir, "_diff.tex"),
+                            os.path.join(work_dir, diff_name + ".tex"))
+
+        # The previous build's PDF must be published before latexmk
+        # overwrites it
+        if background is not None:
+            background.wait()
+
+        # Compile the diff document with latexmk
+        ltmk_cmd = "latexmk -f -pdf -bibtex-cond {0}.tex".format(diff_name)
+        _timed_call(timings, "latexmk", call, ltmk_cmd, cwd=work_dir,
+                    env=tex_env(*tex_dirs))
+
+        finish_args = (work_dir, diff_name, output_name,
+                       build_dir is not None)
+        if background is None:
+            _finish_build(*finish_args)
         else:
-            name = parsed_args.name
+            background.submit(_finish_build, *finish_args)
+        submitted = True
+    finally:
+        if not submitted and build_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        log.info("{0}: {1}".format(output_name, ", ".join(
+            "{0} {1:.2f} s".format(stage, t) for stage, t in timings)))
+
+
+def _finish_build(work_dir, diff_name, output_name, keep_work_dir):
+    """Publish the PDF of a diff build to ``build/`` and delete the work
+    directory unless it is kept.
+    """
+    try:
+        built_pdf_path = os.path.join(work_dir, diff_name + ".pdf")
+        pdf_path = os.path.join("build", "{0}.pdf".format(output_name))
+        if os.path.exists(built_pdf_path):
+            _makedirs(os.path.dirname(pdf_path))
+            if keep_work_dir:
+                # latexmk expects to find its output on the next run
+                shutil.copy2(built_pdf_path, pdf_path)
+            else:
+                shutil.move(built_pdf_path, pdf_path)
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _timed_call(timings, stage, func, *args, **kwargs):
+    """Call `func`, appending its ``(stage, seconds)`` to `timings`."""
+    start = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings.append((stage, time.time() - start))
+
+
+class BackgroundWorker(object):
+    """Run the post-build work of diff pipelines (publishing the PDF and
+    deleting scratch directories) on a background thread, so the caller
+    can start its next build sooner.
+    """
+
+    log = logging.getLogger(__name__)
 
-        git_diff_pipeline(
-            name,
-            self.app.options.master,
-            parsed_args.prev_commit)
+    def __init__(self):
+        super(BackgroundWorker, self).__init__()
+        self._pool = ThreadPool(1)
+        self._pending = []
 
+    def submit(self, func, *args):
+        """Run ``func(*args)`` in the background."""
+        self._pending.append(self._pool.apply_async(func, args))
 
-def git_diff_pipeline(output_name, master_path, prev_commit):
-    """Pipeline for typesetting latexdiff against a commit in git history."""
+    def wait(self):
+        """Wait for all submitted work to finish, logging any failures."""
+        pending, self._pending = self._pending, []
+        for result in pending:
+            try:
+                result.get()
+            except Exception as e:
+                self.log.error("Post-build step failed ({0}: {1})".format(
+                    e.__class__.__name__, e))
+
+    def close(self):
+        """Finish all submitted work and stop the background thread."""
+        self.wait()
+        self._pool.close()
+        self._pool.join()
+
+
+def run_latexdiff(prev_path, current_path, output_path, call=None,
+                  cache=None, chunked=False, jobs=None, engine="latexdiff",
+                  exclude=None):
+    """Run ``latexdiff`` between two inlined documents.
+
+    Parameters
+    ----------
+    prev_path : str
+        Path to the inlined previous document.
+    current_path : str
+        Path to the inlined current document.
+    output_path : str
+        Path where the difference document is written.
+    call : callable
+        Function that runs a shell command (such as
+        :meth:`preprint.supervisor.BuildSupervisor.call`).
+    cache : :class:`preprint.cache.TextCache`
+        Optional cache of ``latexdiff`` output.
+    chunked : bool
+        If `True`, split the documents at ``\\section``/``\\chapter``
+        boundaries and diff matching sections in parallel (see
+        :func:`run_chunked_latexdiff`).
+    jobs : int
+        Number of ``latexdiff`` processes to run at once in chunked mode.
+        Defaults to the number of CPUs.
+    engine : str
+        ``"latexdiff"`` to run the external ``latexdiff`` tool, or
+        ``"python"`` to use the built-in word diff of
+        :mod:`preprint.worddiff` (which ignores `chunked`).
+    exclude : list
+        Names of environments (such as ``"table"``) to leave out of the
+        diff. They are restored afterwards, with a coarse marker if they
+        changed (see :mod:`preprint.exclude`).
+    """
+    log = logging.getLogger(__name__)
+    if call is None:
+        call = _shell_call
+    key = None
+    if cache is not None:
+        key = cache_key(LATEXDIFF_OPTIONS, engine,
+                        "chunked" if chunked else "whole",
+                        u" ".join(exclude or []),
+                        file_digest(prev_path), file_digest(current_path))
+        diff_text = cache.get(key)
+        if diff_text is not None:
+            log.debug("Using cached latexdiff output")
+            with codecs.open(output_path, 'w', encoding='utf-8') as f:
+                f.write(diff_text)
+            return
+
+    if exclude:
+        prev_path, prev_regions = _mask_file(prev_path, exclude)
+        current_path, current_regions = _mask_file(current_path, exclude)
+        log.debug("Excluded {0:d} environment(s) from the diff".format(
+            len(current_regions)))
+
+    if engine == "python":
+        status = _worddiff_files(prev_path, current_path, output_path)
+    elif chunked:
+        status = run_chunked_latexdiff(prev_path, current_path, output_path,
+                                       call=call, jobs=jobs)
+    else:
+        status = _latexdiff_files(prev_path, current_path, output_path, call)
+
+    if exclude and os.path.exists(output_path):
+        with codecs.open(output_path, 'r', encoding='utf-8') as f:
+            diff_text = restore_environments(f.read(), prev_regions,
+                                             current_regions)
+        with codecs.open(output_path, 'w', encoding='utf-8') as f:
+            f.write(diff_text)
+
+    if cache is not None and status == 0:
+        try:
+            with codecs.open(output_path, 'r', encoding='utf-8') as f:
+                cache.put(key, f.read())
+        except UnicodeDecodeError:
+            log.debug("Not caching latexdiff output (not UTF-8)")
+
+
+def run_chunked_latexdiff(prev_path, current_path, output_path, call=None,
+                          jobs=None):
+    """Run ``latexdiff`` section by section, in parallel.
+
+    Both documents are split at ``\\section``/``\\chapter`` boundaries
+    and their sections are aligned by heading. Each changed pair of sections
+    is diffed by its own ``latexdiff`` process (unchanged sections are
+    copied as-is), and the results are stitched into one document under the
+    diffed preamble. If the sections cannot be aligned one-to-one (because
+    sections were added, removed or moved), the whole documents are diffed
+    instead.
+
+    Returns
+    -------
+    status : int
+        Exit status of ``latexdiff`` (non-zero if any chunk failed).
+    """
     log = logging.getLogger(__name__)
+    if call is None:
+        call = _shell_call
+    with codecs.open(prev_path, 'r', encoding='utf-8') as f:
+        prev_doc = split_document(f.read())
+    with codecs.open(current_path, 'r', encoding='utf-8') as f:
+        current_doc = split_document(f.read())
+    pairs = None
+    if prev_doc is not None and current_doc is not None:
+        pairs = align_sections(prev_doc, current_doc)
+    if pairs is None:
+        log.debug("Sections could not be aligned; diffing whole document")
+        return _latexdiff_files(prev_path, current_path, output_path, call)
+
+    chunk_dir = os.path.join(os.path.dirname(os.path.abspath(output_path)),
+                             "_chunks")
+    _makedirs(chunk_dir)
+    chunks = [(preamble_document(prev_doc), preamble_document(current_doc))]
+    chunks.extend(pairs)
+    changed = [i for i, (prev, current) in enumerate(chunks)
+               if i == 0 or prev != current]
+    log.debug("Diffing {0:d} of {1:d} section(s) in parallel".format(
+        len(changed) - 1, len(chunks) - 1))
+
+    def _diff_chunk(i):
+        paths = [os.path.join(chunk_dir, "{0}_{1:04d}.tex".format(kind, i))
+                 for kind in ("prev", "current", "diff")]
+        for path, text in zip(paths[:2], chunks[i]):
+            with codecs.open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        status = _latexdiff_files(paths[0], paths[1], paths[2], call)
+        with codecs.open(paths[2], 'r', encoding='utf-8') as f:
+            return status, f.read()
 
-    current_path = inline_current(master_path)
-    log.debug("current_path {0}".format(current_path))
-    prev_path = inline_prev(prev_commit, master_path)
-    log.debug("prev_path {0}".format(prev_path))
-
-    # Run latexmk
-    diff_path = os.path.splitext(output_name)[0]
-    ldiff_cmd = "latexdiff --type=CTRADITIONAL {prev} {current} > {diff}.tex".\
-        format(prev=prev_path, current=current_path, diff=diff_path)
-    subprocess.call(ldiff_cmd, shell=True)
-
-    # Compile the diff document with latexmk
-    ltmk_cmd = "latexmk -f -pdf -bibtex-cond {0}.tex".format(diff_path)
-    subprocess.call(ltmk_cmd, shell=True)
-
-    # Copy to build directory
-    if not os.path.exists("build"):
-        os.makedirs("build")
-    pdf_path = "{0}.pdf".format(output_name)
-    if os.path.exists(pdf_path):
-        shutil.move(pdf_path, os.path.join("build", pdf_path))
-
-    # Clean up
-    ltmk_cmd = "latexmk -f -pdf -bibtex-cond -c {0}.tex".format(diff_path)
-    subprocess.call(ltmk_cmd, shell=True)
-    build_exts = ['Notes.bib', '.bbl', '.tex']
-    for ext in build_exts:
-        path = "".join((output_name, ext))
-        if os.path.exists(path):
-            os.remove(path)
-    os.remove(prev_path)
-    os.remove(current_path)
-
-
-def inline_current(root_tex_path):
-    """Inline the current manuscript."""
+    n_threads = max(1, min(jobs or multiprocessing.cpu_count(),
+                           len(changed)))
+    pool = ThreadPool(n_threads)
+    try:
+        results = dict(zip(changed, pool.map(_diff_chunk, changed)))
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    status = max(results[i][0] for i in changed)
+    section_diffs = [results[i][1] if i in results else chunks[i][1]
+                     for i in range(1, len(chunks))]
+    with codecs.open(output_path, 'w', encoding='utf-8') as f:
+        f.write(stitch(results[0][1], section_diffs, current_doc.postamble))
+    return status
+
+
+def _latexdiff_files(prev_path, current_path, output_path, call):
+    """Run ``latexdiff`` on two files, returning its exit status."""
+    work_dir = os.path.dirname(os.path.abspath(output_path))
+    ldiff_cmd = "latexdiff {opts} {prev} {current} > {diff}".format(
+        opts=LATEXDIFF_OPTIONS,
+        prev=os.path.relpath(prev_path, work_dir),
+        current=os.path.relpath(current_path, work_dir),
+        diff=os.path.basename(output_path))
+    return call(ldiff_cmd, cwd=work_dir)
+
+
+def _mask_file(path, exclude):
+    """Write a copy of the document at `path` with the `exclude`
+    environments replaced by placeholders.
+
+    Returns
+    -------
+    masked_path : str
+        Path of the masked copy, next to `path`.
+    regions : dict
+        The excluded regions (see
+        :func:`preprint.exclude.mask_environments`).
+    """
+    with codecs.open(path, 'r', encoding='utf-8') as f:
+        tex, regions = mask_environments(f.read(), exclude)
+    masked_path = os.path.splitext(path)[0] + "_masked.tex"
+    with codecs.open(masked_path, 'w', encoding='utf-8') as f:
+        f.write(tex)
+    return masked_path, regions
+
+
+def _worddiff_files(prev_path, current_path, output_path):
+    """Diff two files with the built-in word diff, returning a zero exit
+    status for symmetry with :func:`_latexdiff_files`.
+    """
+    with codecs.open(prev_path, 'r', encoding='utf-8') as f:
+        prev_tex = f.read()
+    with codecs.open(current_path, 'r', encoding='utf-8') as f:
+        current_tex = f.read()
+    with codecs.open(output_path, 'w', encoding='utf-8') as f:
+        f.write(diff_tex(prev_tex, current_tex))
+    return 0
+
+
+def _replace_if_changed(src, dst):
+    """Move `src` to `dst`, unless `dst` already has the same content."""
+    if os.path.exists(dst) and filecmp.cmp(src, dst, shallow=False):
+        os.remove(src)
+    else:
+        os.rename(src, dst)
+
+
+def _makedirs(path):
+    """Make the directory `path` if it does not already exist."""
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _shell_call(cmd, **kwargs):
+    """Run the shell command `cmd`, returning its exit code."""
+    return subprocess.call(cmd, shell=True, **kwargs)
+
+
+def inline_current(root_tex_path, output_dir="."):
+    """Inline the current manuscript.
+
+    Returns
+    -------
+    output_path : str
+        Path to the inlined latex document (``_current.tex`` in
+        `output_dir`) for latexdiff processing.
+    """
+    log = logging.getLogger(__name__)
     base_dir = os.path.dirname(root_tex_path)
+
+    def _read(path):
+        full_path = os.path.join(base_dir, *path.split(u"/"))
+        try:
+            with codecs.open(full_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except IOError:
+            log.warning("Cannot open {0} for inlining".format(full_path))
+            return None
+
     with codecs.open(root_tex_path, 'r', encoding='utf-8') as f:
         root_text = f.read()
-        root_text = remove_comments(root_text)
-        root_text = inline(root_text, base_dir=base_dir)
-    output_path = "_current.tex"
+    root_text = inline_tex(remove_comments(root_text), _read)
+    output_path = os.path.join(output_dir, "_current.tex")
     if os.path.exists(output_path):
         os.remove(output_path)
     with codecs.open(output_path, 'w', encoding='utf-8') as f:
@@ -99,7 +716,8 @@ def inline_current(root_tex_path):
     return output_path
 
 
-def inline_prev(commit_ref, root_tex_path):
+def inline_prev(commit_ref, root_tex_path, cache=None, output_dir=".",
+                filename="_prev.tex"):
     """Inline the previous manuscript in the git tree.
 
     Parameters
@@ -108,6 +726,14 @@ def inline_prev(commit_ref, root_tex_path):
         Commit reference string.
     root_tex_path : str
         Path to the root tex document in the filesystem.
+    cache : :class:`preprint.cache.TextCache`
+        Optional cache of inlined revisions. Entries are keyed by the
+        commit's full SHA, the path of the root document and
+        :data:`INLINE_VERSION`, so they never go stale.
+    output_dir : str
+        Directory in which to write the inlined document.
+    filename : str
+        Filename of the inlined document.
 
     Returns
     -------
@@ -120,15 +746,17 @@ def inline_prev(commit_ref, root_tex_path):
     git_root = absolute_git_root_dir(root_tex_path)
     rel_root_tex_path = os.path.relpath(os.path.abspath(root_tex_path),
                                         git_root)
-    root_text = read_git_blob(commit_ref, rel_root_tex_path,
-                              repo_dir=git_root)
-    log.debug("prev root_text")
-    log.debug(root_text)
-    root_text = remove_comments(root_text)
-    root_text = inline_blob(commit_ref, root_text,
-                            base_dir=os.path.dirname(rel_root_tex_path),
-                            repo_dir=git_root)
-    output_path = "_prev.tex"
+    reader = get_reader(git_root)
+    root_text = None
+    if cache is not None:
+        key = cache_key("inline", INLINE_VERSION, reader.resolve(commit_ref),
+                        rel_root_tex_path)
+        root_text = cache.get(key)
+    if root_text is None:
+        root_text = inline_revision(reader, commit_ref, rel_root_tex_path)
+        if cache is not None:
+            cache.put(key, root_text)
+    output_path = os.path.join(output_dir, filename)
     if os.path.exists(output_path):
         os.remove(output_path)
     with codecs.open(output_path, 'w', encoding='utf-8') as f:
@@ -136,25 +764,201 @@ def inline_prev(commit_ref, root_tex_path):
     return output_path
 
 
+def inline_revision(reader, commit_ref, rel_root_tex_path):
+    """Inline a manuscript from the tree of a git commit.
+
+    All files are read through a single
+    :class:`preprint.gitobjects.GitObjectReader`, so the cost of inlining
+    does not grow with the number of git round-trips.
+
+    Parameters
+    ----------
+    reader : :class:`preprint.gitobjects.GitObjectReader`
+        Reader for the git repository.
+    commit_ref : str
+        Commit reference string.
+    rel_root_tex_path : str
+        Path of the root tex document, relative to the repository root.
+
+    Returns
+    -------
+    root_text : unicode
+        The inlined manuscript, with comments removed from the root
+        document.
+    """
+    root_text = reader.read_text(commit_ref, rel_root_tex_path)
+    root_text = remove_comments(root_text)
+    return _inline_git_text(reader, commit_ref, root_text,
+                            posixpath.dirname(rel_root_tex_path))
+
+
+def _inline_git_text(reader, commit_ref, text, base_dir):
+    """Recursively inline the documents that `text` inputs, reading them
+    from the tree of a git commit.
+    """
+    log = logging.getLogger(__name__)
+
+    def _read(path):
+        tree_path = posixpath.join(base_dir, path)
+        try:
+            return reader.read_text(commit_ref, tree_path)
+        except GitObjectError:
+            log.warning("Cannot find {0} in {1} for inlining".format(
+                tree_path, commit_ref))
+            return None
+
+    return inline_tex(text, _read)
+
+
+def inline_tex(text, read_text, parents=()):
+    """Recursively inline the documents that `text` inputs.
+
+    ``\\input{name}`` and ``\\include{name}`` are replaced by the text of
+    the document, and ``\\InputIfFileExists{name}{then}{else}`` by ``then``
+    followed by the document's text, or by ``else`` if it does not exist.
+    As in LaTeX, names are relative to the root document's directory, and
+    ``.tex`` is added to names without it.
+
+    Parameters
+    ----------
+    text : unicode
+        Text to process.
+    read_text : callable
+        Function that takes the POSIX path of a document, relative to the
+        root document's directory, and returns its text, or `None` if it
+        does not exist.
+    parents : tuple
+        Paths of the documents being inlined around `text`, which are not
+        inlined again.
+
+    Returns
+    -------
+    text : unicode
+        Text with the input documents inlined.
+    """
+    log = logging.getLogger(__name__)
+
+    def _read(name):
+        path = posixpath.normpath(name.strip())
+        if not path.endswith(".tex"):
+            path = ".".join((path, "tex"))
+        if path in parents:
+            log.warning("{0} inputs itself; not inlining it again".format(
+                path))
+            return None
+        included_text = read_text(path)
+        if included_text is None:
+            return None
+        return inline_tex(included_text, read_text, parents + (path,))
+
+    def _sub(match):
+        if match.group(4) is not None:
+            included_text = _read(match.group(4))
+            if included_text is None:
+                return u""
+            return included_text
+        included_text = _read(match.group(1))
+        if included_text is None:
+            return inline_tex(match.group(3), read_text, parents)
+        return inline_tex(match.group(2), read_text, parents) + included_text
+
+    return input_pattern.sub(_sub, text)
+
+
+def materialize_revision(commit_ref, root_tex_path, output_dir):
+    """Write the figures, bibliographies and styles used by a revision from
+    its git tree into a build directory.
+
+    Only the revision's dependencies (see
+    :func:`preprint.revbuild.input_closure`) are written, and only if their
+    content differs from what is already in `output_dir`, so that
+    incremental builds stay incremental.
+
+    Parameters
+    ----------
+    commit_ref : str
+        Commit reference string.
+    root_tex_path : str
+        Path to the root tex document in the filesystem.
+    output_dir : str
+        Build directory. Files are written at their paths relative to the
+        root document's directory.
+
+    Returns
+    -------
+    paths : list
+        Paths of the files in `output_dir` that came from the tree.
+    """
+    log = logging.getLogger(__name__)
+    files = TreeFiles(get_reader(root_tex_path), commit_ref)
+    base_dir = os.path.dirname(os.path.abspath(root_tex_path))
+    paths = []
+    for path in input_closure(files, root_tex_path):
+        if os.path.splitext(path)[-1].lstrip(".").lower() \
+                not in TREE_FILE_EXTS:
+            continue
+        rel_path = os.path.relpath(path, base_dir)
+        if rel_path.startswith(os.pardir + os.sep):
+            log.debug("Not materializing {0}, which is outside of the root "
+                      "document's directory".format(path))
+            continue
+        output_path = os.path.join(output_dir, rel_path)
+        _write_if_changed(output_path, files.read_bytes(path))
+        paths.append(output_path)
+    log.debug("Materialized {0:d} file(s) from {1}".format(len(paths),
+                                                           commit_ref))
+    return paths
+
+
+def _copy_bbl(root_tex_path, work_dir, diff_name):
+    """Use the revision's ``.bbl`` (if it was committed) as the difference
+    document's bibliography.
+    """
+    bbl_name = os.path.splitext(os.path.basename(root_tex_path))[0] + ".bbl"
+    bbl_path = os.path.join(work_dir, bbl_name)
+    if os.path.exists(bbl_path):
+        with open(bbl_path, 'rb') as f:
+            _write_if_changed(os.path.join(work_dir, diff_name + ".bbl"),
+                              f.read())
+
+
+def _write_if_changed(path, data):
+    """Write bytes `data` to `path` unless the file already holds them."""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    _makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def resolve_commit(commit_ref, repo_dir="."):
+    """Resolve a commit reference (SHA fragment, tag, branch or ``HEAD``) to
+    the full SHA of its commit.
+    """
+    return get_reader(repo_dir).resolve(commit_ref)
+
+
 def get_n_commits():
     """Count commits in a repo from HEAD."""
-    repo = git.Repo(".")
-    commits = list(repo.iter_commits())
-    n = len(commits)
-    return n
+    return get_resolver(".").count('HEAD')
 
 
 def get_commits():
-    """Returns a list of commits in the repository."""
+    """Returns a list of commits in the repository.
+
+    The :class:`git.Commit` objects are created from the cached SHA index
+    and only read their data from git when it is accessed.
+    """
     repo = git.Repo(".")
-    commits = list(repo.iter_commits())
-    return commits
+    return [git.Commit(repo, binascii.unhexlify(sha))
+            for sha in get_resolver(".").history()]
 
 
 def match_commit(sha):
     """Match the sha fragment to a commit."""
-    commits = get_commits()
-    for cm in commits:
-        if cm.hexsha.startswith(sha):
-            return cm
-    return None
+    matched_sha = get_resolver(".").match(sha)
+    if matched_sha is None:
+        return None
+    return git.Repo(".").commit(matched_sha)
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 # encoding: utf-8
+import os
+import shutil
 import logging
 import subprocess
 
 from cliff.command import Command
 
 from .vc import run_vc
+from .revbuild import build_revision
 
 
 class Make(Command):
@@ -19,10 +22,36 @@ class Make(Command):
             '--cmd',
             default=self.app.confs.config('cmd'),
             help="Command to run for compilation")
+        parser.add_argument(
+            '--rev',
+            default=None,
+            help="Build the PDF of a git revision (without checking it "
+                 "out) into build/")
         return parser
 
     def take_action(self, parsed_args):
+        if parsed_args.rev is not None:
+            self._make_revision(parsed_args)
+            return
         run_vc()
         cmd = parsed_args.cmd.format(master=self.app.options.master)
         self.log.debug("Compiling with {0}".format(cmd))
         subprocess.call(cmd, shell=True)
+
+    def _make_revision(self, parsed_args):
+        """Build a git revision and copy its PDF into ``build/``."""
+        master = self.app.options.master
+        cmd = parsed_args.cmd.format(master=master)
+        pdf_path = build_revision(
+            parsed_args.rev, master, cmd,
+            scratch_root=self.app.confs.config('scratch_dir'))
+        if pdf_path is None:
+            # cliff reports the error and exits with a non-zero status
+            raise RuntimeError("Could not build {0}".format(parsed_args.rev))
+        output_path = os.path.join("build", "{0}_{1}.pdf".format(
+            os.path.splitext(os.path.basename(master))[0],
+            parsed_args.rev.replace("/", "-")))
+        if not os.path.exists("build"):
+            os.makedirs("build")
+        shutil.copy2(pdf_path, output_path)
+        self.log.info("Wrote {0}".format(output_path))
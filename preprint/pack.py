@@ -6,15 +6,34 @@ Command for packaging the manuscript for submission.
 
 import logging
 import os
+import json
 import shutil
 import codecs
 import re
 import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from paperweight.texutils import inline, remove_comments, inline_bbl
 
 from cliff.command import Command
 
+from .cache import FileCache, cache_key
+from .filehash import file_digest
+from .archive import SubmissionArchive, ARCHIVE_FORMATS
+from .scratch import make_scratch_dir
+
+
+MANIFEST_NAME = ".preprint-pack.json"
+RASTER_SETTINGS = {"density": 300, "quality": 80, "trim": True}
+
+figs_pattern = re.compile(ur"\\includegraphics(.*?){(.*?)}", re.UNICODE)
+
+
+class FigureInstallError(Exception):
+    """Raised when figures cannot be installed in the build directory."""
+    pass
+
 
 class Package(Command):
     """Package manuscript for arxiv/journal submission"""
@@ -46,17 +65,52 @@ class Package(Command):
             default=2.,
             type=float,
             help="Max figure size (MB) before converting to JPEG (for arxiv)")
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Number of figures to copy and convert in parallel.")
+        parser.add_argument(
+            '--archive',
+            choices=ARCHIVE_FORMATS,
+            default=None,
+            help="Write the package straight into build/name.tar.gz or "
+                 "build/name.zip instead of a directory.")
         return parser
 
     def take_action(self, parsed_args):
-        dirname = os.path.join("build", parsed_args.name)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-
         self._build_style = parsed_args.style
         self._ext_priority = parsed_args.exts
         self._max_size = parsed_args.maxsize
+        self._jobs = parsed_args.jobs
+
+        if self._build_style == "aastex":
+            tex_name = "ms.tex"
+        else:
+            tex_name = os.path.basename(self.app.options.master)
+
+        if parsed_args.archive is not None:
+            archive_path = os.path.join("build", ".".join(
+                (parsed_args.name, parsed_args.archive)))
+            with SubmissionArchive(archive_path,
+                                   parsed_args.archive) as archive:
+                tex = self._make_tex(archive=archive)
+                archive.add_text(tex, tex_name)
+            self.log.info("Wrote {0} ({1:d} files; SHA-256 sums in "
+                          "{0}.sha256)".format(archive_path,
+                                               len(archive.checksums)))
+            return
 
+        dirname = os.path.join("build", parsed_args.name)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tex = self._make_tex(dirname=dirname)
+        self._write_tex(tex, os.path.join(dirname, tex_name))
+
+    def _make_tex(self, dirname=None, archive=None):
+        """Inline the manuscript, install its figures into the build
+        directory `dirname` (or the `archive`), and inline its bibliography.
+        """
         bbl_path = ".".join((os.path.splitext(self.app.options.master)[0],
                              'bbl'))
 
@@ -64,24 +118,18 @@ class Package(Command):
             root_text = f.read()
         tex = inline(root_text)
         tex = remove_comments(tex)
-        tex = self._process_figures(tex, dirname)
+        tex = self._process_figures(tex, dirname, archive)
         if os.path.exists(bbl_path):
             with codecs.open(bbl_path, 'r', encoding='utf-8') as f:
                 bbl_text = f.read()
             tex = inline_bbl(tex, bbl_text)
         else:
             self.log.debug("Skipping .bbl installation")
+        return tex
 
-        if self._build_style == "aastex":
-            output_tex_path = os.path.join(dirname, "ms.tex")
-        else:
-            output_tex_path = os.path.join(
-                dirname,
-                os.path.basename(self.app.options.master))
-        self._write_tex(tex, output_tex_path)
-
-    def _process_figures(self, tex, dirname):
-        """Discover figures and copy to root of build directory.
+    def _process_figures(self, tex, dirname, archive=None):
+        """Discover figures and copy to root of build directory (or add
+        them to the `archive`).
 
         Returns
         -------
@@ -95,15 +143,31 @@ class Package(Command):
         elif self._build_style == "arxiv":
             maxsize = self._max_size
 
+        if archive is not None:
+            return archive_figs(
+                tex, figs, archive,
+                naming=self._build_style,
+                format_priority=self._ext_priority,
+                max_size=maxsize,
+                jobs=self._jobs,
+                raster_cache=FileCache('rasters', ext=".jpg"),
+                scratch_root=self.app.confs.config('scratch_dir'))
         tex = install_figs(
             tex, figs, dirname,
             naming=self._build_style,
             format_priority=self._ext_priority,
-            max_size=maxsize)
+            max_size=maxsize,
+            jobs=self._jobs,
+            raster_cache=FileCache('rasters', ext=".jpg"))
         return tex
 
     def _write_tex(self, tex, path):
-        """Write the LaTeX to the output path."""
+        """Write the LaTeX to the output path, unless it is unchanged."""
+        if os.path.exists(path):
+            with codecs.open(path, 'r', encoding='utf-8') as f:
+                if f.read() == tex:
+                    self.log.debug("{0} is up to date".format(path))
+                    return
         with codecs.open(path, 'w', encoding='utf-8') as f:
             f.write(tex)
 
@@ -111,6 +175,10 @@ class Package(Command):
 def discover_figures(tex, ext_priority):
     """Find all figures in the manuscript.
 
+    Each directory holding figures is listed once, and figures are resolved
+    against that listing, so only the figure files that exist are
+    ``stat``-ed.
+
     Returns
     -------
     figs : dict
@@ -118,16 +186,14 @@ def discover_figures(tex, ext_priority):
         as the key and and values are dicts with keys: path, options and
         figure environment.
     """
-    figs_pattern = re.compile(
-        ur"\\includegraphics(.*?){(.*?)}",
-        re.UNICODE)
     matches = figs_pattern.findall(tex)
+    index = _index_dirs(os.path.dirname(path) for opts, path in matches)
     figs = {}
     for i, match in enumerate(matches):
         opts, path = match
         basename = os.path.splitext(os.path.basename(path))[0]
         # Find all formats this file exists in
-        exts = _find_exts(path, ext_priority)
+        exts = _find_exts(path, ext_priority, index)
         # Get file sizes for all variants here
         _dir = os.path.dirname(path)
         sizes = []
@@ -143,24 +209,54 @@ def discover_figures(tex, ext_priority):
     return figs
 
 
-def _find_exts(fig_path, ext_priority):
-    """Return a tuple of all formats for which a figure exists."""
-    basepath = os.path.splitext(fig_path)[0]
-    has_exts = []
-    for ext in ext_priority:
-        p = ".".join((basepath, ext))
-        if os.path.exists(p):
-            has_exts.append(ext)
-            # print "exists", p
-    print fig_path, has_exts
-    return tuple(has_exts)
+def _index_dirs(dirnames):
+    """List the files in each directory.
+
+    Returns
+    -------
+    index : dict
+        Keys are the directory names (as given); values are sets of the
+        filenames in each directory (empty if the directory cannot be read).
+    """
+    index = {}
+    for dirname in dirnames:
+        if dirname in index:
+            continue
+        try:
+            index[dirname] = set(os.listdir(dirname or u"."))
+        except OSError:
+            index[dirname] = set()
+    return index
+
+
+def _find_exts(fig_path, ext_priority, index):
+    """Return a tuple of all formats for which a figure exists.
+
+    `index` is the listing of the figure directories, from
+    :func:`_index_dirs`.
+    """
+    dirname = os.path.dirname(fig_path)
+    basename = os.path.basename(os.path.splitext(fig_path)[0])
+    names = index[dirname]
+    return tuple(ext for ext in ext_priority
+                 if ".".join((basename, ext)) in names)
 
 
 def install_figs(tex, figs, install_dir, naming=None,
                  format_priority=('pdf', 'eps', 'ps', 'png', 'jpg', 'tif'),
-                 max_size=None):
+                 max_size=None, jobs=None, raster_cache=None):
     """Copy each figure to the build directory and update tex with new path.
 
+    Figures are copied (and rasterized) in parallel; the tex is updated
+    beforehand, so the result does not depend on the order in which the
+    copies finish.
+
+    The installed figures are recorded in a manifest in `install_dir`
+    (see :data:`MANIFEST_NAME`). Figures whose source, content and
+    conversion settings match the manifest, and whose installed file was
+    not modified since, are left as they are, and files of the previous
+    build that are no longer needed are deleted.
+
     Parameters
     ----------
     tex : unicode
@@ -177,8 +273,181 @@ def install_figs(tex, figs, install_dir, naming=None,
     max_size : float
         Maximum size for a figure before converting it into a JPEG.
         If ``None``, no conversions are attempted.
+    jobs : int
+        Number of figures to install at once. Defaults to the number of
+        CPUs.
+    raster_cache : :class:`preprint.cache.FileCache`
+        Optional cache of JPEG versions of figures (see
+        :func:`rasterize_figure`).
+
+    Raises
+    ------
+    FigureInstallError
+        If a figure could not be copied or rasterized.
     """
-    for figname, fig in figs.iteritems():
+    manifest = _read_manifest(install_dir)
+    plan, new_paths = _plan_figs(figs, install_dir, naming, format_priority,
+                                 max_size)
+    tasks = []
+    up_to_date = []
+    for figname, full_path, install_path, rasterize in plan:
+        name = os.path.basename(_output_path(install_path, rasterize))
+        entry = manifest.get(name)
+        if _is_unchanged(entry, full_path, rasterize,
+                         os.path.join(install_dir, name)):
+            up_to_date.append((None, name, entry))
+            continue
+        tasks.append((figname, full_path, install_path, rasterize,
+                      raster_cache, entry))
+    tex = rewrite_figure_paths(tex, new_paths)
+
+    results = []
+    if tasks:
+        n_threads = max(1, min(jobs or multiprocessing.cpu_count(),
+                               len(tasks)))
+        pool = ThreadPool(n_threads)
+        try:
+            results = pool.map(_install_fig, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    results.extend(up_to_date)
+    installed = dict((name, entry) for error, name, entry in results
+                     if error is None)
+    for name in set(manifest) - set(name for e, name, entry in results):
+        # Left over from a previous build
+        path = os.path.join(install_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+    _write_manifest(install_dir, installed)
+    log = logging.getLogger(__name__)
+    log.debug("Installed {0:d} of {1:d} figure(s); the rest were "
+              "up to date".format(
+                  sum(1 for error, name, entry in results
+                      if entry.get('updated')), len(results)))
+    errors = [result[0] for result in results if result[0] is not None]
+    if errors:
+        raise FigureInstallError(u"; ".join(errors))
+    return tex
+
+
+def archive_figs(tex, figs, archive, naming=None,
+                 format_priority=('pdf', 'eps', 'ps', 'png', 'jpg', 'tif'),
+                 max_size=None, jobs=None, raster_cache=None,
+                 scratch_root=None):
+    """Add each figure to a submission archive and update tex with the new
+    path.
+
+    Figures are streamed into the archive straight from their sources, in
+    order of figure number. Only figures that are converted into JPEGs are
+    written to disk, in a scratch directory; conversions run in parallel.
+
+    Parameters
+    ----------
+    tex : unicode
+        The tex document as a unicode string.
+    figs : dict
+        Figures found by :func:`discover_figures`.
+    archive : :class:`preprint.archive.SubmissionArchive`
+        The archive.
+    naming : str
+        Style for figure naming, (``'aastex'|'arxiv'|None``).
+    format_priority : list
+        List of figure file extensions, in order of preference to use in
+        the final build.
+    max_size : float
+        Maximum size for a figure before converting it into a JPEG.
+        If ``None``, no conversions are attempted.
+    jobs : int
+        Number of figures to convert at once. Defaults to the number of
+        CPUs.
+    raster_cache : :class:`preprint.cache.FileCache`
+        Optional cache of JPEG versions of figures (see
+        :func:`rasterize_figure`).
+    scratch_root : str
+        Directory in which to create the scratch directory for conversions.
+        Defaults to the system's temporary directory.
+
+    Raises
+    ------
+    FigureInstallError
+        If a figure could not be converted or archived.
+    """
+    scratch_dir = make_scratch_dir(prefix="preprint-pack-", root=scratch_root)
+    try:
+        plan, new_paths = _plan_figs(figs, scratch_dir, naming,
+                                     format_priority, max_size)
+        tex = rewrite_figure_paths(tex, new_paths)
+        tasks = [task + (raster_cache,) for task in plan]
+        errors = []
+        n_threads = max(1, min(jobs or multiprocessing.cpu_count(),
+                               len(tasks)))
+        pool = ThreadPool(n_threads)
+        try:
+            # Add figures to the archive as they become ready
+            for task, (error, output_path) in zip(
+                    tasks, pool.imap(_prepare_fig, tasks)):
+                figname, full_path, install_path, rasterize = task[:4]
+                if error is None:
+                    try:
+                        archive.add_file(output_path, os.path.basename(
+                            _output_path(install_path, rasterize)))
+                    except (IOError, OSError) as e:
+                        error = u"{0} ({1}): {2}".format(figname, full_path,
+                                                         e)
+                if error is not None:
+                    errors.append(error)
+                elif rasterize:
+                    os.remove(output_path)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    if errors:
+        raise FigureInstallError(u"; ".join(errors))
+    return tex
+
+
+def _prepare_fig(task):
+    """Make the file to archive for a figure: its source, or a JPEG
+    version of it in the scratch directory.
+
+    Returns
+    -------
+    error : unicode
+        A description of the failure, naming the figure, or `None`.
+    path : str
+        Path of the file to archive.
+    """
+    figname, full_path, install_path, rasterize, raster_cache = task
+    if not rasterize:
+        return None, full_path
+    try:
+        # Rasterizing overwrites .jpg figures, so work on a copy
+        shutil.copy(full_path, install_path)
+        rasterize_figure(install_path, cache=raster_cache, **RASTER_SETTINGS)
+    except (IOError, OSError, FigureInstallError) as e:
+        return u"{0} ({1}): {2}".format(figname, full_path, e), None
+    return None, _output_path(install_path, rasterize)
+
+
+def _plan_figs(figs, install_dir, naming, format_priority, max_size):
+    """Choose the file, installed name and conversion of each figure.
+
+    Returns
+    -------
+    plan : list
+        Tuples of the figure's name, the path of the chosen file, its
+        install path in `install_dir`, and whether to rasterize it, in order
+        of figure number.
+    new_paths : dict
+        Mapping of figure paths in the tex to their installed paths (see
+        :func:`rewrite_figure_paths`).
+    """
+    plan = []
+    new_paths = {}
+    for figname, fig in sorted(figs.iteritems(), key=lambda f: f[1]['num']):
         if len(fig['exts']) == 0:
             continue
         # get the priority graphics file type
@@ -201,29 +470,218 @@ def install_figs(tex, figs, install_dir, naming=None,
                 install_dir,
                 os.path.basename(full_path))
         figs[figname]["installed_path"] = install_path
+        rasterize = bool(max_size and figsize > max_size)
+        plan.append((figname, full_path, install_path, rasterize))
+        new_paths[fig['path']] = os.path.basename(
+            os.path.splitext(install_path)[0])
+    return plan, new_paths
+
+
+def _output_path(install_path, rasterize):
+    """Path of an installed figure, after any conversion to JPEG."""
+    if rasterize:
+        return os.path.splitext(install_path)[0] + ".jpg"
+    return install_path
+
+
+def rewrite_figure_paths(tex, new_paths):
+    """Replace the paths of ``\\includegraphics`` commands, in a single pass
+    over the document.
+
+    Parameters
+    ----------
+    tex : unicode
+        The tex document.
+    new_paths : dict
+        Mapping of figure paths, as written in the document, to their new
+        paths. Figures not in the mapping are left alone.
+
+    Returns
+    -------
+    tex : unicode
+        The updated document.
+    """
+    def _replace(m):
+        new_path = new_paths.get(m.group(2))
+        if new_path is None:
+            return m.group(0)
+        return u"\\includegraphics" + m.group(1) + u"{" + new_path + u"}"
+
+    return figs_pattern.sub(_replace, tex)
+
+
+def _is_unchanged(entry, full_path, rasterize, output_path):
+    """Check a figure's manifest `entry` against its source file (by the
+    source's modification time and size) and its output at `output_path`.
+    """
+    if entry is None or entry.get("source") != full_path \
+            or entry.get("rasterize") != _raster_settings(rasterize):
+        return False
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return False
+    return (entry.get("mtime"), entry.get("size")) == \
+        (st.st_mtime, st.st_size) \
+        and _output_unchanged(entry, output_path)
+
+
+def _output_unchanged(entry, output_path):
+    """Check that the figure installed at `output_path` was not modified
+    since its manifest `entry` was recorded.
+    """
+    try:
+        st = os.stat(output_path)
+    except OSError:
+        return False
+    return (entry.get("output_mtime"), entry.get("output_size")) == \
+        (st.st_mtime, st.st_size)
+
+
+def _output_stat(output_path):
+    """Manifest fields that record the state of an installed figure."""
+    st = os.stat(output_path)
+    return {"output_mtime": st.st_mtime, "output_size": st.st_size}
+
+
+def _raster_settings(rasterize):
+    """Conversion settings recorded in the manifest."""
+    return RASTER_SETTINGS if rasterize else None
+
+
+def _install_fig(task):
+    """Install a figure into the build directory, rasterizing it if needed.
+
+    If the figure's manifest entry only differs from its source by the
+    modification time, the source is hashed, and the figure is only
+    installed again if its content changed.
+
+    Returns
+    -------
+    error : unicode
+        A description of the failure, naming the figure, or `None`.
+    name : unicode
+        Filename of the installed figure within the build directory.
+    entry : dict
+        The figure's manifest entry.
+    """
+    figname, full_path, install_path, rasterize, raster_cache, old_entry = \
+        task
+    output_path = _output_path(install_path, rasterize)
+    name = os.path.basename(output_path)
+    try:
+        st = os.stat(full_path)
+        entry = {"source": full_path,
+                 "mtime": st.st_mtime,
+                 "size": st.st_size,
+                 "sha1": file_digest(full_path),
+                 "rasterize": _raster_settings(rasterize)}
+        if old_entry is not None \
+                and _output_unchanged(old_entry, output_path) \
+                and all(old_entry.get(k) == entry[k]
+                        for k in ("source", "sha1", "rasterize")):
+            entry.update(_output_stat(output_path))
+            return None, name, entry
+        # Never write through a hard link that older versions of preprint
+        # left in the build directory
+        if os.path.lexists(install_path):
+            os.remove(install_path)
         shutil.copy(full_path, install_path)
-        if max_size and figsize > max_size:
-            rasterize_figure(install_path)
-        # update tex by replacing old filename with new.
-        # Note that fig['env'] currently has escaped slash for re; this is
-        # removed here. Might want to think of a convention so it's less kludgy
-        old_fig_cmd = ur"{env}{opts}{{{path}}}".format(
-            env=fig['env'].replace(u"\\\\", u"\\"),
-            opts=fig['options'],
-            path=fig['path'])
-        new_fig_cmd = ur"{env}{opts}{{{path}}}".format(
-            env=fig['env'].replace(u"\\\\", u"\\"),
-            opts=fig['options'],
-            path=os.path.basename(os.path.splitext(install_path)[0]))
-        tex = tex.replace(old_fig_cmd, new_fig_cmd)
-    return tex
+        if rasterize:
+            rasterize_figure(install_path, cache=raster_cache,
+                             **RASTER_SETTINGS)
+        entry.update(_output_stat(output_path))
+    except (IOError, OSError, FigureInstallError) as e:
+        return u"{0} ({1}): {2}".format(figname, full_path, e), name, {}
+    entry["updated"] = True
+    return None, name, entry
 
 
-def rasterize_figure(original_path):
-    """Make a JPEG version of a figure, deleting the original."""
+def _read_manifest(install_dir):
+    """Read the manifest of the figures installed in `install_dir`.
+
+    Returns
+    -------
+    manifest : dict
+        Mapping of installed filenames to their entries (empty if there is
+        no readable manifest).
+    """
+    path = os.path.join(install_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_manifest(install_dir, manifest):
+    """Write the manifest of the figures installed in `install_dir`."""
+    path = os.path.join(install_dir, MANIFEST_NAME)
+    manifest = dict((name, dict((k, v) for k, v in entry.iteritems()
+                                if k != "updated"))
+                    for name, entry in manifest.iteritems())
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def rasterize_figure(original_path, cache=None, density=300, quality=80,
+                     trim=True):
+    """Make a JPEG version of a figure, deleting the original.
+
+    A figure that is already a ``.jpg`` is replaced by its JPEG version.
+    The figure must therefore be a copy, and not a link to the source.
+
+    Parameters
+    ----------
+    original_path : str
+        Path of the figure.
+    cache : :class:`preprint.cache.FileCache`
+        Optional cache of JPEGs. Entries are keyed by the content of the
+        figure and the conversion settings, so a figure is only converted
+        again once it (or the settings) changed.
+    density : int
+        Resolution (dots per inch) at which vector figures are rendered.
+    quality : int
+        JPEG quality, from 1 to 100.
+    trim : bool
+        Trim the figure's blank margins.
+
+    Raises
+    ------
+    FigureInstallError
+        If ``convert`` fails; the original is kept.
+    """
+    log = logging.getLogger(__name__)
     jpg_path = os.path.splitext(original_path)[0] + ".jpg"
-    subprocess.call(
-        "convert -density 300 -trim -quality 80 {path} {jpgpath}".format(
-            path=original_path, jpgpath=jpg_path),
+    if cache is not None:
+        key = cache_key("convert", file_digest(original_path), str(density),
+                        str(quality), str(trim))
+        cached_path = cache.get(key)
+        if cached_path is not None:
+            try:
+                shutil.copyfile(cached_path, jpg_path)
+            except IOError:
+                # Evicted in the meantime; convert it again
+                pass
+            else:
+                log.debug("Using cached JPEG of {0}".format(original_path))
+                _remove_original(original_path, jpg_path)
+                return
+    status = subprocess.call(
+        "convert -density {density:d} {trim}-quality {quality:d} "
+        "{path} {jpgpath}".format(
+            density=density, trim="-trim " if trim else "",
+            quality=quality, path=original_path, jpgpath=jpg_path),
         shell=True)
-    os.remove(original_path)
+    if status != 0:
+        raise FigureInstallError(
+            "convert exited with status {0:d}".format(status))
+    if cache is not None:
+        cache.put(key, jpg_path)
+    _remove_original(original_path, jpg_path)
+
+
+def _remove_original(original_path, jpg_path):
+    """Delete a rasterized figure, unless its JPEG version replaced it."""
+    if os.path.abspath(original_path) != os.path.abspath(jpg_path):
+        os.remove(original_path)
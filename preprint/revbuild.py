@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Build the PDF of a past revision straight from git objects, without
+checking it out.
+
+The revision's input closure (the root document and every file it depends
+upon, see :func:`preprint.depgraph.find_dependencies`) is written to a
+private scratch directory and compiled there. PDFs are cached by the hash of
+their inputs, so building a revision again, or any revision with identical
+inputs, is instant.
+"""
+
+import os
+import shutil
+import logging
+import subprocess
+
+from .cache import FileCache, cache_key
+from .depgraph import find_dependencies
+from .gitobjects import get_reader, TreeFiles
+from .scratch import make_scratch_dir
+from .vc import vc_exists, write_vc_revision
+
+
+log = logging.getLogger(__name__)
+
+
+def build_revision(commit_ref, master_path, cmd, cache=None,
+                   scratch_root=None, quiet=False):
+    """Build the PDF of a git revision.
+
+    Parameters
+    ----------
+    commit_ref : str
+        Commit reference string.
+    master_path : str
+        Path to the root tex document, relative to the current directory.
+    cmd : str
+        Command that compiles `master_path` from the current directory
+        (such as ``latexmk -f -pdf paper.tex``). It is run in a copy of the
+        current directory as it was in the revision.
+    cache : :class:`preprint.cache.FileCache`
+        Cache of built PDFs. Defaults to the ``pdfs`` cache in
+        ``.preprint-cache/``.
+    scratch_root : str
+        Directory in which to create the scratch directory. Defaults to the
+        system's temporary directory.
+    quiet : bool
+        If `True`, discard the output of the build command.
+
+    Returns
+    -------
+    pdf_path : str
+        Path to the PDF in the cache, or `None` if the build failed. Only
+        successful builds are cached.
+    """
+    if cache is None:
+        cache = FileCache('pdfs', ext=".pdf")
+    files = TreeFiles(get_reader(master_path), commit_ref)
+    inputs = input_closure(files, master_path)
+    key_parts = [u"{0} {1}".format(files.tree_path(p), files.blob_sha(p))
+                 for p in inputs]
+    if vc_exists():
+        # vc.tex stamps the PDF with the commit itself
+        key_parts.append(u"vc " + files.commit)
+    key = cache_key(cmd, files.tree_path(os.getcwd()), *key_parts)
+    pdf_path = cache.get(key)
+    if pdf_path is not None:
+        log.debug("Using cached build of {0}".format(commit_ref))
+        return pdf_path
+
+    work_dir = make_scratch_dir(prefix="preprint-rev-", root=scratch_root)
+    try:
+        status, built_pdf_path = compile_tree(files, inputs, master_path, cmd,
+                                              work_dir, quiet=quiet)
+        if status != 0:
+            log.error("Building {0} failed ({1} exited with status "
+                      "{2:d})".format(commit_ref, cmd, status))
+            return None
+        if built_pdf_path is None:
+            log.error("Building {0} did not produce a PDF".format(
+                commit_ref))
+            return None
+        return cache.put(key, built_pdf_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compile_tree(files, inputs, master_path, cmd, work_dir, quiet=False):
+    """Write the inputs of a revision into `work_dir` and compile them.
+
+    If the project uses vc, the revision's ``vc.tex`` is generated as well.
+    The build command gets no input, so TeX stops at the first error (such
+    as a missing input) instead of prompting.
+
+    Parameters
+    ----------
+    files : :class:`preprint.gitobjects.TreeFiles`
+        The revision's tree.
+    inputs : list
+        Paths of the files to write (see :func:`input_closure`).
+    master_path : str
+        Path to the root tex document, relative to the current directory.
+    cmd : str
+        Build command, run in the copy of the current directory.
+    work_dir : str
+        Empty scratch directory that mirrors the repository.
+    quiet : bool
+        If `True`, discard the command's output.
+
+    Returns
+    -------
+    status : int
+        Exit status of the build command.
+    pdf_path : str
+        Path of the built PDF, or `None` if no PDF was made.
+    """
+    for path in inputs:
+        output_path = os.path.join(work_dir,
+                                   *files.tree_path(path).split(u"/"))
+        if not os.path.exists(os.path.dirname(output_path)):
+            os.makedirs(os.path.dirname(output_path))
+        with open(output_path, 'wb') as f:
+            f.write(files.read_bytes(path))
+    log.debug("Wrote {0:d} input(s) of {1} to {2}".format(
+        len(inputs), files.commit[:7], work_dir))
+
+    build_dir = os.path.join(work_dir,
+                             *files.tree_path(os.getcwd()).split(u"/"))
+    if not os.path.exists(build_dir):
+        os.makedirs(build_dir)
+    if vc_exists() and not write_vc_revision(files.commit, build_dir):
+        return 1, None
+    with open(os.devnull, 'r+') as devnull:
+        if quiet:
+            status = subprocess.call(cmd, shell=True, cwd=build_dir,
+                                     stdin=devnull, stdout=devnull,
+                                     stderr=subprocess.STDOUT)
+        else:
+            status = subprocess.call(cmd, shell=True, cwd=build_dir,
+                                     stdin=devnull)
+
+    pdf_name = os.path.splitext(master_path)[0] + ".pdf"
+    for pdf_path in (os.path.join(build_dir, pdf_name),
+                     os.path.join(build_dir, os.path.basename(pdf_name))):
+        if os.path.exists(pdf_path):
+            return status, pdf_path
+    return status, None
+
+
+def input_closure(files, master_path):
+    """Paths of the files needed to build a revision.
+
+    Parameters
+    ----------
+    files : :class:`preprint.gitobjects.TreeFiles`
+        The revision's tree.
+    master_path : str
+        Path to the root tex document.
+
+    Returns
+    -------
+    paths : list
+        Sorted absolute (work tree) paths of the root document, its
+        dependencies that exist in the revision, and the root document's
+        ``.bbl`` if it was committed.
+    """
+    paths = set(find_dependencies(master_path, files=files).files)
+    bbl_path = os.path.abspath(os.path.splitext(master_path)[0] + ".bbl")
+    if files.exists(bbl_path):
+        paths.add(bbl_path)
+    return sorted(paths)
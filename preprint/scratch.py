@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Private scratch directories for builds that must not touch the working
+directory, so that several builds can run side by side.
+"""
+
+import os
+import tempfile
+
+
+def make_scratch_dir(prefix="preprint-", root=None):
+    """Create a new, private scratch directory.
+
+    Parameters
+    ----------
+    prefix : str
+        Prefix of the directory's name.
+    root : str
+        Directory to create the scratch directory in (such as ``/dev/shm``
+        to build on a tmpfs). Defaults to the system's temporary directory.
+
+    Returns
+    -------
+    path : str
+        Absolute path of the scratch directory. The caller is responsible for
+        deleting it.
+    """
+    if root is not None:
+        root = os.path.expandvars(os.path.expanduser(root))
+        if not os.path.exists(root):
+            os.makedirs(root)
+    return tempfile.mkdtemp(prefix=prefix, dir=root)
+
+
+def tex_env(*dirs):
+    """Environment in which TeX tools also search `dirs` for their inputs.
+
+    Builds in a scratch directory use this to find figures, bibliographies
+    and styles that live in the project directory.
+    """
+    env = dict(os.environ)
+    search_dirs = [os.path.abspath(d) for d in dirs]
+    for var in ('TEXINPUTS', 'BIBINPUTS', 'BSTINPUTS'):
+        # A trailing separator keeps TeX's default search path
+        env[var] = os.pathsep.join(search_dirs + [env.get(var, "")])
+    return env
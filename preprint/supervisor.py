@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Supervision of build subprocesses so that stale builds can be cancelled.
+
+A :class:`BuildSupervisor` runs every command of a build in its own process
+group. When a newer change supersedes the build, :meth:`BuildSupervisor.cancel`
+kills the whole process tree (the shell, ``latexmk`` and any ``pdflatex`` or
+``bibtex`` children) and the build raises :class:`BuildCancelled`.
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class BuildCancelled(Exception):
+    """Raised when a build is superseded by newer changes."""
+    pass
+
+
+class BuildSupervisor(object):
+    """Own the subprocesses of a build so they can be killed on demand.
+
+    Commands may be run concurrently from several threads; cancelling the
+    build kills all of them.
+
+    Parameters
+    ----------
+    kill_timeout : float
+        Seconds to wait after asking a process tree to terminate before
+        forcefully killing it.
+    """
+
+    def __init__(self, kill_timeout=2.):
+        super(BuildSupervisor, self).__init__()
+        self._kill_timeout = kill_timeout
+        self._lock = threading.Lock()
+        self._procs = set()
+        self._timers = {}
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        """`True` if the current build has been cancelled."""
+        return self._cancelled
+
+    def reset(self):
+        """Prepare the supervisor for a new build."""
+        with self._lock:
+            self._cancelled = False
+
+    def call(self, cmd, **kwargs):
+        """Run the shell command `cmd`, like :func:`subprocess.call`.
+
+        Raises
+        ------
+        BuildCancelled
+            If the build was cancelled before or while running `cmd`.
+        """
+        with self._lock:
+            if self._cancelled:
+                raise BuildCancelled(cmd)
+            proc = _popen_group(cmd, **kwargs)
+            self._procs.add(proc)
+        returncode = proc.wait()
+        with self._lock:
+            self._procs.discard(proc)
+            timer = self._timers.pop(proc, None)
+            if self._cancelled:
+                if timer is not None:
+                    timer.cancel()
+                # Sweep up children that outlived the shell
+                _kill_group(proc)
+                raise BuildCancelled(cmd)
+        return returncode
+
+    def cancel(self):
+        """Cancel the build, killing the process trees of running commands.
+        """
+        with self._lock:
+            self._cancelled = True
+            for proc in self._procs:
+                if proc.poll() is not None or proc in self._timers:
+                    continue
+                log.debug("Killing superseded build (pid {0:d})".format(
+                    proc.pid))
+                _terminate_group(proc)
+                timer = threading.Timer(self._kill_timeout, _kill_group,
+                                        args=(proc,))
+                timer.daemon = True
+                timer.start()
+                self._timers[proc] = timer
+
+
+def _popen_group(cmd, **kwargs):
+    """Start the shell command `cmd` as the leader of a new process group."""
+    if os.name == 'posix':
+        kwargs['preexec_fn'] = os.setsid
+    else:
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    return subprocess.Popen(cmd, shell=True, **kwargs)
+
+
+def _terminate_group(proc):
+    """Ask the process tree led by `proc` to terminate."""
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            subprocess.call("taskkill /T /F /PID {0:d}".format(proc.pid),
+                            shell=True)
+    except OSError:
+        # Process group already exited
+        pass
+
+
+def _kill_group(proc):
+    """Forcefully kill whatever remains of the process tree led by `proc`."""
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        elif proc.poll() is None:
+            proc.kill()
+    except OSError:
+        pass
@@ -10,10 +10,17 @@ See http://www.ctan.org/pkg/vc
 import os
 import subprocess
 import logging
+from distutils.spawn import find_executable
 
 
 log = logging.getLogger(__name__)
 
+# The commit metadata that the vc script passes to vc-git.awk
+VC_LOG_FORMAT = ("Hash: %H%nAbr. Hash: %h%nParent Hashes: %P%n"
+                 "Abr. Parent Hashes: %p%nAuthor Name: %an%n"
+                 "Author Email: %ae%nAuthor Date: %ai%nCommitter Name: %cn%n"
+                 "Committer Email: %ce%nCommitter Date: %ci%n")
+
 
 def vc_exists():
     """Return `True` if the project uses vc."""
@@ -30,3 +37,42 @@ def run_vc():
     if vc_exists():
         log.debug("Running vc")
         subprocess.call("./vc", shell=True)
+
+
+def write_vc_revision(commit_ref, output_dir):
+    """Write the ``vc.tex`` of a git revision, as the vc tool would for a
+    checkout of that revision, using the project's ``vc-git.awk``.
+
+    Parameters
+    ----------
+    commit_ref : str
+        Commit reference string.
+    output_dir : str
+        Directory in which to write ``vc.tex``.
+
+    Returns
+    -------
+    success : bool
+        `True` if ``vc.tex`` was written.
+    """
+    env = dict(os.environ, LC_ALL="C")
+    awk = find_executable('gawk') or 'awk'
+    vc_path = os.path.join(output_dir, "vc.tex")
+    try:
+        commit_log = subprocess.check_output(
+            ['git', '--no-pager', 'log', '-1', commit_ref,
+             '--pretty=format:' + VC_LOG_FORMAT], env=env)
+        with open(vc_path, 'w') as f:
+            p = subprocess.Popen(
+                [awk, '-v', 'script=log', '-v', 'full=0', '-f',
+                 os.path.abspath('vc-git.awk')],
+                stdin=subprocess.PIPE, stdout=f, env=env)
+            p.communicate(commit_log)
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.error("Could not write vc.tex for {0}: {1}".format(commit_ref, e))
+        return False
+    if p.returncode != 0:
+        log.error("Could not write vc.tex for {0}: {1} exited with "
+                  "status {2:d}".format(commit_ref, awk, p.returncode))
+        return False
+    return True
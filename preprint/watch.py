@@ -1,6 +1,7 @@
 import logging
 import os
-import subprocess
+import shutil
+import threading
 import time
 
 from watchdog.observers import Observer
@@ -8,8 +9,15 @@ from watchdog.events import FileSystemEventHandler
 
 from cliff.command import Command
 
-from preprint.latexdiff import git_diff_pipeline
+from preprint.latexdiff import git_diff_pipeline, resolve_commit, ENGINES, \
+    BackgroundWorker
 from .vc import run_vc
+from .depgraph import find_dependencies
+from .filehash import FileHashCache
+from .cache import TextCache, CACHE_DIR
+from .gitobjects import is_sha
+from .scratch import make_scratch_dir
+from .supervisor import BuildSupervisor, BuildCancelled
 
 
 class Watch(Command):
@@ -34,23 +42,61 @@ class Watch(Command):
             const='HEAD',
             default=None,
             help="Typeset diff against git commit")
+        parser.add_argument(
+            '--delay',
+            type=float,
+            default=self.app.confs.config('delay'),
+            help="Quiet period (seconds) to wait for more changes before "
+                 "compiling")
+        parser.add_argument(
+            '--recursive',
+            action='store_true',
+            default=False,
+            help="Watch all files with matching extensions in the project, "
+                 "rather than only the document's dependencies")
+        parser.add_argument(
+            '--chunked',
+            action='store_true',
+            default=False,
+            help="With --diff, run latexdiff section by section, in "
+                 "parallel")
+        parser.add_argument(
+            '--engine',
+            choices=ENGINES,
+            default=self.app.confs.config('diff_engine'),
+            help="With --diff, diff with the external latexdiff tool or the "
+                 "built-in python engine")
+        parser.add_argument(
+            '--exclude',
+            nargs='*',
+            default=self.app.confs.config('diff_exclude'),
+            help="With --diff, environments to leave out of the diff")
         return parser
 
     def take_action(self, parsed_args):
         ignore = (os.path.splitext(self.app.options.master)[0] + ".pdf",
-                  'build', '_current.tex', '_prev.tex')
+                  'build', '_current.tex', '_prev.tex', CACHE_DIR)
+        if parsed_args.recursive:
+            watch_master = None
+        else:
+            watch_master = self.app.options.master
         if parsed_args.diff is None:
             handler = RegularChangeHandler(
-                parsed_args.cmd, parsed_args.exts, ignore)
+                parsed_args.cmd, parsed_args.exts, ignore,
+                delay=parsed_args.delay, master_path=watch_master)
         else:
             handler = DiffChangeHandler(
                 self.app.options.master, parsed_args.diff, parsed_args.exts,
-                ignore)
+                ignore, delay=parsed_args.delay, watch_master=watch_master,
+                scratch_root=self.app.confs.config('scratch_dir'),
+                chunked=parsed_args.chunked, engine=parsed_args.engine,
+                exclude=parsed_args.exclude)
         self._watch(handler)
 
     def _watch(self, handler):
         observer = Observer()
-        observer.schedule(handler, '.', recursive=True)
+        handler.schedule(observer)
+        handler.start()
         observer.start()
         try:
             while True:
@@ -58,49 +104,278 @@ class Watch(Command):
         except KeyboardInterrupt:
             observer.stop()
         observer.join()
+        handler.stop()
+
+
+class CompileQueue(object):
+    """Coalesce change notifications into debounced compilations.
+
+    Notifications that arrive within ``delay`` seconds of each other are
+    merged into a single compile. Notifications that arrive while a compile
+    is running collapse into at most one follow-up compile. If a
+    `supervisor` is given the running compile is cancelled as soon as a
+    newer notification arrives, and the follow-up compile starts from the
+    latest state.
+
+    Parameters
+    ----------
+    compile_func : callable
+        Function (without arguments) that runs a compilation.
+    delay : float
+        Quiet period, in seconds, to wait after the latest notification
+        before compiling.
+    supervisor : :class:`preprint.supervisor.BuildSupervisor`
+        Optional supervisor of the subprocesses run by `compile_func`.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, compile_func, delay=0.5, supervisor=None):
+        super(CompileQueue, self).__init__()
+        self._compile = compile_func
+        self._delay = max(delay, 0.)
+        self._supervisor = supervisor
+        self._running = False
+        self._cond = threading.Condition()
+        self._pending = []
+        self._last_event = 0.
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="preprint-compile")
+        self._thread.daemon = True
+
+    def start(self):
+        """Start the compile worker thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread once any running compile has finished."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            if self._running and self._supervisor is not None:
+                self._supervisor.cancel()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def notify(self, path):
+        """Queue a compile in response to a change of `path`."""
+        with self._cond:
+            self._pending.append(path)
+            self._last_event = time.time()
+            self._cond.notify_all()
+            if self._running and self._supervisor is not None:
+                self._supervisor.cancel()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                # Wait until no new notification arrives for `delay` seconds
+                while not self._stopped:
+                    remaining = self._last_event + self._delay - time.time()
+                    if remaining <= 0.:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopped:
+                    return
+                paths = self._pending
+                self._pending = []
+                self._running = True
+                if self._supervisor is not None:
+                    self._supervisor.reset()
+            self.log.debug("Compiling after {0:d} change event(s): {1}".format(
+                len(paths), ", ".join(sorted(set(paths)))))
+            try:
+                self._compile()
+            except BuildCancelled:
+                self.log.debug("Compilation superseded by newer changes")
+            except Exception:
+                self.log.exception("Compilation failed")
+            finally:
+                with self._cond:
+                    self._running = False
 
 
 class BaseChangeHandler(FileSystemEventHandler):
-    """React to modified files."""
-    def __init__(self, exts, ignores):
+    """React to modified files.
+
+    If a `master_path` is given, only the files that the master document
+    depends upon (see :func:`preprint.depgraph.find_dependencies`) and their
+    directories are watched; the dependencies are refreshed whenever a
+    ``.tex`` dependency changes. Otherwise the whole project directory is
+    watched recursively for files with the extensions `exts`.
+
+    Events for files whose content did not actually change (for example
+    from ``touch`` or ``git checkout``) are skipped by comparing content
+    hashes. Matching events are handed to a :class:`CompileQueue` so that
+    bursts of events trigger a single compilation. Subclasses run their
+    build commands through ``self._supervisor`` so that a compilation
+    superseded by newer changes is killed and restarted.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, exts, ignores, delay=0.5, master_path=None):
         super(BaseChangeHandler, self).__init__()
         self._exts = exts
         self._ignores = ignores
+        self._project_dir = os.path.abspath(os.curdir)
+        self._watch_master = master_path
+        self._deps = None
+        self._observer = None
+        self._watches = {}
+        self._deps_lock = threading.RLock()
+        self._hashes = FileHashCache()
+        self._n_skipped = 0
+        self._supervisor = BuildSupervisor()
+        self._queue = CompileQueue(self.run_compile, delay=delay,
+                                   supervisor=self._supervisor)
+
+    def schedule(self, observer):
+        """Schedule the watches of this handler with `observer`."""
+        self._observer = observer
+        if self._watch_master is None:
+            observer.schedule(self, '.', recursive=True)
+        else:
+            self._refresh_dependencies()
+
+    def _refresh_dependencies(self):
+        """Rebuild the dependency set and update the watched directories."""
+        with self._deps_lock:
+            self._deps = find_dependencies(self._watch_master)
+            self._hashes.prime(self._deps.files)
+            dirs = self._deps.directories
+            for d in set(self._watches) - dirs:
+                self._observer.unschedule(self._watches.pop(d))
+            for d in dirs - set(self._watches):
+                self._watches[d] = self._observer.schedule(
+                    self, d, recursive=False)
+
+    def start(self):
+        """Start compiling in response to queued changes."""
+        self._queue.start()
+
+    def stop(self):
+        """Stop compiling in response to queued changes."""
+        self._queue.stop()
 
     def on_any_event(self, event):
         """If a file or folder is changed."""
         if event.is_directory:
             return
+        elif self._watch_master is not None:
+            self._on_dependency_event(event)
         else:
             event_ext = os.path.splitext(event.src_path)[-1]\
                 .lower().lstrip('.')
             if event_ext in self._exts:
-                for ig in self._ignores:
-                    if ig in event.src_path:
-                        return
+                if self._is_ignored(event.src_path):
+                    return
                 # passed all tests
-                self.run_compile()
+                if self._content_changed(event.src_path):
+                    self._queue.notify(event.src_path)
         return
 
+    def _is_ignored(self, path):
+        """Return `True` if `path` is one of the outputs to ignore."""
+        return is_ignored(path, self._ignores, self._project_dir)
+
+    def _content_changed(self, path):
+        """Return `True` if the content of `path` changed since last seen."""
+        if self._hashes.update(path):
+            return True
+        self._n_skipped += 1
+        self.log.debug(
+            "Skipping unchanged {0} ({1:d} no-op event(s) skipped)".format(
+                path, self._n_skipped))
+        return False
+
+    def _on_dependency_event(self, event):
+        """Queue a compile if the event touches a dependency."""
+        paths = [event.src_path]
+        if hasattr(event, 'dest_path'):
+            paths.append(event.dest_path)
+        with self._deps_lock:
+            changed = [p for p in paths if p in self._deps
+                       and not self._is_ignored(p)
+                       and self._content_changed(p)]
+            if not changed:
+                return
+            # A changed or newly created tex file may alter the dependencies
+            if any(p.endswith('.tex') or os.path.abspath(p)
+                   in self._deps.missing for p in changed):
+                self._refresh_dependencies()
+        for p in changed:
+            self._queue.notify(p)
+
+
+def is_ignored(path, ignores, project_dir):
+    """Check whether a file is ignored by the watcher.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file (absolute, or relative to the current directory).
+    ignores : list
+        Strings that, if found in the path of a file relative to
+        `project_dir`, mark that file as ignored (such as ``'build'``).
+    project_dir : str
+        Absolute path of the project directory. Files outside of it are
+        never ignored, and the directories above it are not matched, so a
+        project in ``~/builds/paper/`` is watched like any other.
+    """
+    rel_path = os.path.relpath(os.path.abspath(path), project_dir)
+    if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+        return False
+    return any(ig in rel_path for ig in ignores)
+
 
 class RegularChangeHandler(BaseChangeHandler):
     """Class for reacting to modified files and doing a regular compile."""
-    def __init__(self, command, exts, ignores):
-        super(RegularChangeHandler, self).__init__(exts, ignores)
+    def __init__(self, command, exts, ignores, delay=0.5, master_path=None):
+        super(RegularChangeHandler, self).__init__(
+            exts, ignores, delay=delay, master_path=master_path)
         self._cmd = command
 
     def run_compile(self):
         """Run a compilation."""
         run_vc()
-        subprocess.call(self._cmd, shell=True)
+        self._supervisor.call(self._cmd)
 
 
 class DiffChangeHandler(BaseChangeHandler):
-    """React to modified files while building latexdiffs."""
-    def __init__(self, master_path, prev_commit, exts, ignores):
-        super(DiffChangeHandler, self).__init__(exts, ignores)
+    """React to modified files while building latexdiffs.
+
+    The previous revision is resolved to a SHA once, and its inlined text is
+    cached in memory and on disk so that each compile only inlines the
+    current document. Symbolic refs (such as ``HEAD``, branches or tags) are
+    re-resolved before each compile in case they moved.
+
+    The difference document is compiled in a private build directory that
+    keeps LaTeX's auxiliary files for the whole watch session, so each
+    compile is incremental. The directory is deleted when watching stops.
+    The PDF is copied to ``build/`` in the background, so the next compile
+    can start right away.
+    """
+    def __init__(self, master_path, prev_commit, exts, ignores, delay=0.5,
+                 watch_master=None, scratch_root=None, chunked=False,
+                 engine="latexdiff", exclude=None):
+        super(DiffChangeHandler, self).__init__(
+            exts, ignores, delay=delay, master_path=watch_master)
         self._master = master_path
-        self._prev_commit = prev_commit
+        self._prev_ref = prev_commit
+        self._prev_commit = resolve_commit(prev_commit)
+        self._prev_is_sha = is_sha(prev_commit)
+        self._prev_cache = TextCache('revisions')
+        self._diff_cache = TextCache('latexdiff')
+        self._chunked = chunked
+        self._engine = engine
+        self._exclude = exclude
+        self._background = BackgroundWorker()
+        self._build_dir = make_scratch_dir(prefix="preprint-watch-",
+                                           root=scratch_root)
         self._output_name = "{0}_diff".format(
             os.path.splitext(self._master)[0])
         # Hack the ignore list to include the output path
@@ -109,6 +384,32 @@ class DiffChangeHandler(BaseChangeHandler):
 
     def run_compile(self):
         """Run a latexdiff+compile."""
+        self._update_prev_commit()
         git_diff_pipeline(
             self._output_name, self._master,
-            self._prev_commit)
+            self._prev_commit,
+            supervisor=self._supervisor,
+            prev_cache=self._prev_cache,
+            diff_cache=self._diff_cache,
+            build_dir=self._build_dir,
+            chunked=self._chunked,
+            engine=self._engine,
+            exclude=self._exclude,
+            background=self._background)
+
+    def stop(self):
+        """Stop compiling and delete the build directory."""
+        super(DiffChangeHandler, self).stop()
+        self._background.close()
+        shutil.rmtree(self._build_dir, ignore_errors=True)
+
+    def _update_prev_commit(self):
+        """Re-resolve the previous revision if it is a symbolic ref."""
+        if self._prev_is_sha:
+            # A SHA never moves
+            return
+        sha = resolve_commit(self._prev_ref)
+        if sha != self._prev_commit:
+            self.log.debug("{0} moved from {1} to {2}".format(
+                self._prev_ref, self._prev_commit[:7], sha[:7]))
+            self._prev_commit = sha
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+A native word-level diff of LaTeX documents, as a fast alternative to
+running ``latexdiff``.
+
+Documents are tokenized into words, commands (with their arguments), inline
+and display math, comments and alignment characters. The token sequences
+are compared paragraph by paragraph and then word by word, and the changes
+are marked up with the same ``\\DIFadd``/``\\DIFdel`` commands (and
+preamble) as ``latexdiff --type=CTRADITIONAL``.
+
+Like ``latexdiff``, text is wrapped in ``\\DIFadd{}``/``\\DIFdel{}``, while
+commands that cannot be wrapped are kept as-is when added, and commented
+out (``%DIFDELCMD <``) when deleted. Math environments and verbatim text
+are compared as a whole.
+"""
+
+import re
+import difflib
+
+from .chunkdiff import begin_document_pattern
+
+
+# Token kinds: TEXT tokens can be wrapped in \DIFadd{}/\DIFdel{}, while
+# BLOCK tokens (sectioning, environments, comments, display math, ...) can't
+TEXT = 0
+BLOCK = 1
+
+# Commands that are safe to use in the argument of \DIFadd and \DIFdel
+SAFE_COMMANDS = frozenset([
+    'ref', 'eqref', 'pageref', 'autoref', 'cref', 'Cref', 'nameref',
+    'cite', 'citep', 'citet', 'citealt', 'citealp', 'citeauthor',
+    'citeyear', 'citeyearpar',
+    'emph', 'textit', 'textbf', 'textsl', 'textsc', 'texttt', 'textrm',
+    'textsf', 'textmd', 'textup', 'textnormal', 'textsuperscript',
+    'textsubscript', 'underline', 'mbox', 'ensuremath', 'url', 'href',
+    'ldots', 'dots', 'textellipsis', 'LaTeX', 'TeX', 'S', 'P', 'ie', 'eg',
+    'etal'])
+
+# Environments compared as a whole, since their content can't be marked up
+ATOMIC_ENVIRONMENTS = frozenset([
+    'verbatim', 'verbatim*', 'lstlisting', 'comment',
+    'equation', 'equation*', 'align', 'align*', 'alignat', 'alignat*',
+    'eqnarray', 'eqnarray*', 'gather', 'gather*', 'multline', 'multline*',
+    'flalign', 'flalign*', 'displaymath', 'math'])
+
+# Control symbols that delimit math or break lines
+BLOCK_SYMBOLS = frozenset([u"\\\\", u"\\[", u"\\]", u"\\(", u"\\)"])
+
+DIFF_PREAMBLE = u"""%DIF PREAMBLE EXTENSION ADDED BY LATEXDIFF
+%DIF CTRADITIONAL PREAMBLE %DIF PREAMBLE
+\\RequirePackage{color}\\definecolor{RED}{rgb}{1,0,0}\\definecolor{BLUE}{rgb}{0,0,1} %DIF PREAMBLE
+\\RequirePackage[stable]{footmisc} %DIF PREAMBLE
+\\providecommand{\\DIFadd}[1]{{\\protect\\color{blue} \\sf #1}} %DIF PREAMBLE
+\\providecommand{\\DIFdel}[1]{{\\protect\\color{red} [..\\footnote{removed: #1} ]}} %DIF PREAMBLE
+%DIF SAFE PREAMBLE %DIF PREAMBLE
+\\providecommand{\\DIFaddbegin}{} %DIF PREAMBLE
+\\providecommand{\\DIFaddend}{} %DIF PREAMBLE
+\\providecommand{\\DIFdelbegin}{} %DIF PREAMBLE
+\\providecommand{\\DIFdelend}{} %DIF PREAMBLE
+%DIF FLOATSAFE PREAMBLE %DIF PREAMBLE
+\\providecommand{\\DIFaddFL}[1]{\\DIFadd{#1}} %DIF PREAMBLE
+\\providecommand{\\DIFdelFL}[1]{\\DIFdel{#1}} %DIF PREAMBLE
+\\providecommand{\\DIFaddbeginFL}{} %DIF PREAMBLE
+\\providecommand{\\DIFaddendFL}{} %DIF PREAMBLE
+\\providecommand{\\DIFdelbeginFL}{} %DIF PREAMBLE
+\\providecommand{\\DIFdelendFL}{} %DIF PREAMBLE
+%DIF END PREAMBLE EXTENSION ADDED BY LATEXDIFF
+"""
+
+space_pattern = re.compile(ur"\s*", re.UNICODE)
+paragraph_pattern = re.compile(ur"\n[ \t]*\n", re.UNICODE)
+token_pattern = re.compile(
+    ur"(?P<comment>%[^\n]*)"
+    ur"|(?P<display>\$\$.+?\$\$|\\\[.+?\\\])"
+    ur"|(?P<math>\$(?:[^$\\]|\\.)+\$|\\\(.+?\\\))"
+    ur"|(?P<word>[^\s\\{}$%&]+)"
+    ur"|(?P<align>&)",
+    re.UNICODE | re.DOTALL)
+command_pattern = re.compile(ur"\\(?:([a-zA-Z@]+)\*?|.)",
+                             re.UNICODE | re.DOTALL)
+verb_pattern = re.compile(ur"\*?([^a-zA-Z\s*]).*?\1", re.UNICODE)
+arg_space_pattern = re.compile(ur"[ \t]*", re.UNICODE)
+group_pattern = re.compile(ur"\\.|%[^\n]*|[{}\[\]]", re.UNICODE | re.DOTALL)
+begin_env_pattern = re.compile(ur"\\begin\s*{([^}]*)}", re.UNICODE)
+
+
+def diff_tex(prev_tex, current_tex):
+    """Mark up the differences between two LaTeX documents.
+
+    Only the document bodies are compared; the output uses the current
+    preamble, extended with the definitions of the markup commands.
+
+    Parameters
+    ----------
+    prev_tex : unicode
+        Text of the previous document.
+    current_tex : unicode
+        Text of the current document.
+
+    Returns
+    -------
+    diff_tex : unicode
+        The difference document.
+    """
+    prev_begin = begin_document_pattern.search(prev_tex)
+    current_begin = begin_document_pattern.search(current_tex)
+    if prev_begin is None or current_begin is None:
+        # A fragment without a preamble
+        return diff_body(prev_tex, current_tex)
+    return (current_tex[:current_begin.start()] + DIFF_PREAMBLE
+            + current_begin.group()
+            + diff_body(prev_tex[prev_begin.end():],
+                        current_tex[current_begin.end():]))
+
+
+def diff_body(prev_tex, current_tex):
+    """Mark up the differences between two pieces of LaTeX text."""
+    prev_tokens, _ = tokenize(prev_tex)
+    current_tokens, trailing = tokenize(current_tex)
+    writer = _Writer()
+    for tag, i1, i2, j1, j2 in diff_tokens(prev_tokens, current_tokens):
+        if tag == 'equal':
+            for space, text, kind in current_tokens[j1:j2]:
+                writer.write(space)
+                writer.write(text, comment=text.startswith(u"%"))
+            continue
+        if i2 > i1:
+            _mark_deleted(prev_tokens[i1:i2], writer)
+        if j2 > j1:
+            _mark_added(current_tokens[j1:j2], writer)
+    writer.write(trailing)
+    return writer.getvalue()
+
+
+def tokenize(tex):
+    """Split LaTeX text into tokens.
+
+    Returns
+    -------
+    tokens : list
+        List of ``(space, text, kind)`` tuples, where ``space`` is the
+        whitespace preceding the token and ``kind`` is either :data:`TEXT`
+        or :data:`BLOCK`.
+    trailing : unicode
+        Whitespace at the end of `tex`.
+    """
+    tokens = []
+    i, n = 0, len(tex)
+    while True:
+        j = space_pattern.match(tex, i).end()
+        space = tex[i:j]
+        if j >= n:
+            return tokens, space
+        m = token_pattern.match(tex, j)
+        if m is not None:
+            end = m.end()
+            kind = TEXT if m.lastgroup in ('word', 'math') else BLOCK
+        elif tex[j] == u"\\":
+            end, kind = _command_end(tex, j)
+        elif tex[j] == u"{":
+            end = _group_end(tex, j)
+            kind = TEXT if end > j + 1 else BLOCK
+        else:
+            # Stray closing brace or unmatched math shift
+            end, kind = j + 1, BLOCK
+        tokens.append((space, tex[j:end], kind))
+        i = end
+
+
+def _command_end(tex, start):
+    """End of the command at `start` (including its arguments), and its kind.
+    """
+    m = command_pattern.match(tex, start)
+    if m is None:
+        # Backslash at the end of the text
+        return start + 1, BLOCK
+    end = m.end()
+    name = m.group(1)
+    if name is None:
+        symbol = m.group()
+        if symbol == u"\\\\":
+            # Line break, possibly with a starred form and a spacing argument
+            if tex.startswith(u"*", end):
+                end += 1
+            if tex.startswith(u"[", end):
+                end = max(end, _group_end(tex, end))
+        return end, BLOCK if symbol in BLOCK_SYMBOLS else TEXT
+    if name == 'verb':
+        v = verb_pattern.match(tex, end)
+        return (v.end() if v is not None else end), BLOCK
+    while True:
+        k = arg_space_pattern.match(tex, end).end()
+        if k >= len(tex) or tex[k] not in u"{[":
+            break
+        group_end = _group_end(tex, k)
+        if group_end == k + 1:
+            # Unbalanced group
+            break
+        end = group_end
+    if name == 'begin':
+        env = begin_env_pattern.match(tex, start)
+        if env is not None and env.group(1) in ATOMIC_ENVIRONMENTS:
+            end_env = re.compile(ur"\\end\s*{" + re.escape(env.group(1))
+                                 + ur"}", re.UNICODE)
+            e = end_env.search(tex, end)
+            if e is not None:
+                end = e.end()
+    return end, TEXT if name in SAFE_COMMANDS else BLOCK
+
+
+def _group_end(tex, start):
+    """Index just past the ``{...}`` or ``[...]`` group opened at `start`,
+    or ``start + 1`` if the group is not balanced.
+    """
+    opening = tex[start]
+    depth = 0
+    for m in group_pattern.finditer(tex, start + 1):
+        c = m.group()
+        if c == u"{":
+            depth += 1
+        elif c == u"}":
+            if depth == 0:
+                return m.end() if opening == u"{" else start + 1
+            depth -= 1
+        elif c == u"]" and opening == u"[" and depth == 0:
+            return m.end()
+    return start + 1
+
+
+def diff_tokens(prev_tokens, current_tokens):
+    """Compare two token sequences.
+
+    Paragraphs are matched first, so that only the paragraphs that changed
+    are compared word by word. This keeps the diff fast on long documents.
+
+    Returns
+    -------
+    opcodes : generator
+        ``(tag, i1, i2, j1, j2)`` opcodes, as from
+        :meth:`difflib.SequenceMatcher.get_opcodes`, indexing the tokens.
+    """
+    prev_words = [t[1] for t in prev_tokens]
+    current_words = [t[1] for t in current_tokens]
+    prev_pars = _paragraphs(prev_tokens)
+    current_pars = _paragraphs(current_tokens)
+    matcher = difflib.SequenceMatcher(
+        None,
+        [u"\0".join(prev_words[a:b]) for a, b in prev_pars],
+        [u"\0".join(current_words[a:b]) for a, b in current_pars],
+        autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        a1, a2 = _span(prev_pars, i1, i2, len(prev_tokens))
+        b1, b2 = _span(current_pars, j1, j2, len(current_tokens))
+        if tag == 'equal':
+            yield tag, a1, a2, b1, b2
+        elif tag == 'replace' and i2 - i1 == j2 - j1:
+            # Edited paragraphs: compare each pair on its own
+            for (p1, p2), (c1, c2) in zip(prev_pars[i1:i2],
+                                          current_pars[j1:j2]):
+                for opcode in _word_opcodes(prev_words, current_words,
+                                            p1, p2, c1, c2):
+                    yield opcode
+        elif tag == 'replace':
+            for opcode in _word_opcodes(prev_words, current_words,
+                                        a1, a2, b1, b2):
+                yield opcode
+        else:
+            yield tag, a1, a2, b1, b2
+
+
+def _word_opcodes(prev_words, current_words, a1, a2, b1, b2):
+    """Word-level opcodes between two ranges of tokens."""
+    matcher = difflib.SequenceMatcher(None, prev_words[a1:a2],
+                                      current_words[b1:b2], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        yield tag, a1 + i1, a1 + i2, b1 + j1, b1 + j2
+
+
+def _paragraphs(tokens):
+    """``(start, end)`` token indices of each paragraph."""
+    starts = [0] + [i for i, t in enumerate(tokens)
+                    if i > 0 and paragraph_pattern.search(t[0])]
+    ends = starts[1:] + [len(tokens)]
+    if not tokens:
+        return []
+    return zip(starts, ends)
+
+
+def _span(pars, i1, i2, n_tokens):
+    """Token range covered by paragraphs ``i1`` to ``i2``."""
+    if i1 == i2:
+        start = pars[i1][0] if i1 < len(pars) else n_tokens
+        return start, start
+    return pars[i1][0], pars[i2 - 1][1]
+
+
+def _mark_added(tokens, writer):
+    """Write added tokens, wrapping text in ``\\DIFadd``."""
+    run = []
+    for space, text, kind in tokens:
+        if kind == TEXT and run and not paragraph_pattern.search(space):
+            run.append(space + text)
+            continue
+        _flush(run, u"\\DIFadd", writer)
+        writer.write(space)
+        if kind == TEXT:
+            run.append(text)
+        else:
+            writer.write(text, comment=text.startswith(u"%"))
+    _flush(run, u"\\DIFadd", writer)
+
+
+def _mark_deleted(tokens, writer):
+    """Write deleted tokens, wrapping text in ``\\DIFdel`` and commenting
+    out everything else.
+    """
+    run = []
+    for space, text, kind in tokens:
+        # Deleted paragraph breaks are not kept
+        if u"\n" in space:
+            space = u"\n"
+        if kind == TEXT and run:
+            run.append(space + text)
+            continue
+        _flush(run, u"\\DIFdel", writer)
+        writer.write(space)
+        if kind == TEXT:
+            run.append(text)
+        else:
+            writer.write(u"\n".join(u"%DIFDELCMD < " + line
+                                    for line in text.split(u"\n")),
+                         comment=True)
+    _flush(run, u"\\DIFdel", writer)
+
+
+def _flush(run, command, writer):
+    """Write a run of text tokens as the argument of `command`."""
+    if run:
+        writer.write(command + u"{" + u"".join(run) + u"}")
+        del run[:]
+
+
+class _Writer(object):
+    """Accumulate output text, making sure that text written after a
+    comment starts on a new line.
+    """
+
+    def __init__(self):
+        super(_Writer, self).__init__()
+        self._parts = []
+        self._in_comment = False
+
+    def write(self, text, comment=False):
+        if not text:
+            return
+        if self._in_comment and not text.startswith(u"\n"):
+            # The comment swallows this line break, so no space is added
+            self._parts.append(u"\n")
+        self._parts.append(text)
+        self._in_comment = comment
+
+    def getvalue(self):
+        return u"".join(self._parts)
@@ -90,6 +90,7 @@ setup(
             'watch = preprint.watch:Watch',
             'diff = preprint.latexdiff:Diff',
             'pack = preprint.pack:Package',
+            'bisect = preprint.bisection:Bisect',
         ],
     },
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Fixtures shared by the tests that work with git repositories and TeX tools.
+"""
+
+import os
+import subprocess
+
+import pytest
+
+
+def run_git(repo_dir, *args):
+    """Run a git command in `repo_dir`, returning its stripped output."""
+    return subprocess.check_output(
+        ('git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com')
+        + args, cwd=str(repo_dir)).strip()
+
+
+@pytest.fixture
+def git():
+    """Function that runs a git command in a repository
+    (``git(repo_dir, *args)``), returning its stripped output.
+    """
+    return run_git
+
+
+@pytest.fixture
+def git_repo(tmpdir):
+    """An empty git repository in a temporary directory."""
+    run_git(tmpdir, 'init', '-q')
+    return tmpdir
+
+
+LATEXDIFF_SCRIPT = """#!/bin/sh
+echo latexdiff >> "$(dirname "$0")/calls.log"
+echo "% diff of $2 and $3"
+cat "$3"
+"""
+
+# Fake PDF listing the build directory, with the content of each file
+LATEXMK_SCRIPT = """#!/bin/sh
+echo latexmk >> "$(dirname "$0")/calls.log"
+for arg; do doc=$arg; done
+echo run >> "${doc%.tex}.aux"
+listing=$(mktemp)
+for f in $(find . -type f | sort); do echo "== $f"; cat "$f"; done > $listing
+mv $listing "${doc%.tex}.pdf"
+"""
+
+
+@pytest.fixture
+def tex_tools(git_repo, monkeypatch):
+    """Fake ``latexdiff`` and ``latexmk`` commands on the ``PATH``.
+
+    Returns a function that lists the commands run so far.
+    """
+    tools_dir = git_repo.mkdir(".tools")
+    git_repo.join(".git", "info", "exclude").write(".tools\n", mode='a')
+    for name, script in (("latexdiff", LATEXDIFF_SCRIPT),
+                         ("latexmk", LATEXMK_SCRIPT)):
+        tools_dir.join(name).write(script)
+        tools_dir.join(name).chmod(0755)
+    monkeypatch.setenv('PATH', os.pathsep.join((str(tools_dir),
+                                                os.environ['PATH'])))
+
+    def calls():
+        log_path = tools_dir.join("calls.log")
+        return log_path.read().split() if log_path.check() else []
+    return calls
+
+
+@pytest.fixture
+def paper(git_repo, git, monkeypatch):
+    """A paper with a tagged first draft and an edited working tree, as the
+    current directory.
+    """
+    git_repo.join("paper.tex").write(
+        "\\documentclass{article}\n\\begin{document}\n\\input{intro}\n"
+        "\\end{document}\n")
+    git_repo.join("intro.tex").write("First draft.\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'First')
+    git(git_repo, 'tag', 'v1')
+    git_repo.join("intro.tex").write("Second draft.\n")
+    monkeypatch.chdir(git_repo)
+    return git_repo
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for :class:`preprint.archive.SubmissionArchive`.
+"""
+
+import hashlib
+import tarfile
+import zipfile
+
+import pytest
+
+from preprint.archive import SubmissionArchive
+
+
+@pytest.mark.parametrize("fmt", ["tar.gz", "zip"])
+def test_archive_members(tmpdir, fmt):
+    """Test that files and text are archived with their SHA-256 sums."""
+    fig_path = tmpdir.join("fig.pdf")
+    fig_path.write(b"%PDF" + b"\x00" * 100000, mode="wb")
+    archive_path = str(tmpdir.join("build", "paper." + fmt))
+    with SubmissionArchive(archive_path, fmt) as archive:
+        archive.add_file(str(fig_path), u"f1.pdf")
+        archive.add_text(u"Caf\xe9\n", u"ms.tex")
+
+    if fmt == "zip":
+        with zipfile.ZipFile(archive_path) as z:
+            members = dict((n, z.read(n)) for n in z.namelist())
+    else:
+        with tarfile.open(archive_path) as t:
+            members = dict((m.name, t.extractfile(m).read())
+                           for m in t.getmembers())
+    assert members == {"f1.pdf": fig_path.read("rb"),
+                       "ms.tex": u"Caf\xe9\n".encode('utf-8')}
+
+    with open(archive_path + ".sha256") as f:
+        lines = f.read().splitlines()
+    assert lines == ["{0}  {1}".format(hashlib.sha256(members[n]).hexdigest(),
+                                       n) for n in ("f1.pdf", "ms.tex")]
+    assert tmpdir.join("build").listdir(sort=True) == [
+        tmpdir.join("build", "paper." + fmt),
+        tmpdir.join("build", "paper." + fmt + ".sha256")]
+
+
+def test_abort(tmpdir):
+    """Test that a failed archive leaves nothing behind."""
+    archive_path = str(tmpdir.join("paper.tar.gz"))
+    with pytest.raises(OSError):
+        with SubmissionArchive(archive_path, "tar.gz") as archive:
+            archive.add_file(str(tmpdir.join("missing.pdf")), u"f1.pdf")
+    assert tmpdir.listdir() == []
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for :func:`preprint.bisection.parallel_bisect`.
+"""
+
+import math
+
+import pytest
+
+from preprint.bisection import parallel_bisect
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 7])
+def test_parallel_bisect(jobs):
+    """Test finding every possible first failing candidate."""
+    candidates = range(100)
+    for first_bad in candidates:
+        probed = []
+
+        def probe(revs):
+            assert 0 < len(revs) <= jobs
+            probed.extend(revs)
+            return [rev < first_bad for rev in revs]
+
+        found, rounds = parallel_bisect(candidates, probe, jobs)
+        assert found == first_bad
+        assert rounds <= math.ceil(math.log(len(candidates), jobs + 1))
+        assert len(probed) == len(set(probed))
+
+
+def test_single_candidate():
+    """Test that a single candidate needs no probes."""
+    assert parallel_bisect(['a'], None, 4) == ('a', 0)
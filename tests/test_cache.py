@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for the on-disk :class:`preprint.cache.TextCache`.
+"""
+
+import os
+import time
+
+from preprint.cache import TextCache, FileCache, cache_key
+
+
+def test_persistence(tmpdir):
+    """Test that entries are shared between cache instances."""
+    key = cache_key("abc123", u"paper.tex")
+    TextCache('revisions', cache_dir=str(tmpdir)).put(key, u"Caf\xe9")
+    cache = TextCache('revisions', cache_dir=str(tmpdir))
+    assert cache.get(key) == u"Caf\xe9"
+    assert cache.get(cache_key("def456", u"paper.tex")) is None
+
+
+def test_lru_eviction(tmpdir):
+    """Test that least recently used entries are evicted first."""
+    cache = TextCache('revisions', cache_dir=str(tmpdir), max_size=25)
+    cache.put("a", u"a" * 10)
+    cache.put("b", u"b" * 10)
+    # Make "a" the most recently used entry
+    past = time.time() - 100
+    os.utime(str(tmpdir.join('revisions', 'b.txt')), (past, past))
+    assert cache.get("a") == u"a" * 10
+    cache.put("c", u"c" * 10)
+    assert sorted(os.listdir(str(tmpdir.join('revisions')))) == \
+        ['a.txt', 'c.txt']
+    assert TextCache('revisions', cache_dir=str(tmpdir)).get("b") is None
+
+
+def test_file_cache(tmpdir):
+    """Test storing copies of files."""
+    src = tmpdir.join("paper.pdf")
+    src.write("%PDF")
+    cache = FileCache('pdfs', cache_dir=str(tmpdir.join("cache")),
+                      ext=".pdf")
+    assert cache.get("abc") is None
+    path = cache.put("abc", str(src))
+    assert path.endswith("abc.pdf")
+    src.remove()
+    assert cache.get("abc") == path
+    assert open(path).read() == "%PDF"
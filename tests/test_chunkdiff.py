@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for splitting, aligning and stitching documents for section-parallel
+latexdiff with :mod:`preprint.chunkdiff`.
+"""
+
+from preprint.chunkdiff import split_document, align_sections, stitch
+
+
+PREV = (u"\\documentclass{article}\n"
+        u"\\begin{document}\n"
+        u"\\title{Paper}\n"
+        u"\\section{Introduction}\n"
+        u"Old intro.\n"
+        u"\\section{Methods}\n"
+        u"Old methods.\n"
+        u"\\end{document}\n")
+
+
+def test_split_document():
+    """Test splitting a document at its sections."""
+    doc = split_document(PREV)
+    assert doc.preamble == u"\\documentclass{article}\n\\begin{document}"
+    assert doc.sections == [u"\n\\title{Paper}\n",
+                            u"\\section{Introduction}\nOld intro.\n",
+                            u"\\section{Methods}\nOld methods.\n"]
+    assert doc.headings == [u"", u"\\section{Introduction}",
+                            u"\\section{Methods}"]
+    assert doc.postamble == u"\\end{document}\n"
+    assert doc.preamble + u"".join(doc.sections) + doc.postamble == PREV
+    assert split_document(u"\\section{Fragment}") is None
+
+
+def test_align_renamed_section():
+    """Test that renamed sections are aligned by position."""
+    current = PREV.replace(u"{Methods}", u"{Observations}")
+    pairs = align_sections(split_document(PREV), split_document(current))
+    assert len(pairs) == 3
+    assert pairs[2] == (u"\\section{Methods}\nOld methods.\n",
+                        u"\\section{Observations}\nOld methods.\n")
+
+
+def test_align_added_section():
+    """Test that documents with added sections cannot be aligned."""
+    current = PREV.replace(u"\\end{document}",
+                           u"\\section{Results}\nNew.\n\\end{document}")
+    assert align_sections(split_document(PREV),
+                          split_document(current)) is None
+
+
+def test_stitch():
+    """Test stitching chunks under a single preamble."""
+    preamble_diff = (u"\\documentclass{article}\n\\providecommand{\\DIFadd}"
+                     u"\n\\begin{document}\n\\end{document}\n")
+    tex = stitch(preamble_diff, [u"\nA\n", u"B\n"], u"\\end{document}\n")
+    assert tex == (u"\\documentclass{article}\n\\providecommand{\\DIFadd}"
+                   u"\n\\begin{document}\nA\nB\n\\end{document}\n")
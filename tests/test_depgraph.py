@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for discovering a document's dependencies with
+:func:`preprint.depgraph.find_dependencies`.
+"""
+
+import codecs
+
+from preprint.depgraph import find_dependencies
+
+
+def _write(path, text=u""):
+    path.dirpath().ensure(dir=True)
+    with codecs.open(str(path), 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_find_dependencies(tmpdir):
+    """Test that inputs, figures, bibliographies and local styles are found.
+    """
+    master = _write(
+        tmpdir.join("paper.tex"),
+        u"\\documentclass{mycls}\n"
+        u"\\usepackage{amsmath,local}\n"
+        u"\\begin{document}\n"
+        u"\\input{sections/intro}\n"
+        u"% \\input{commented}\n"
+        u"\\includegraphics[width=2in]{figures/plot}\n"
+        u"\\bibliography{refs}\n"
+        u"\\end{document}\n")
+    intro = _write(tmpdir.join("sections", "intro.tex"),
+                   u"\\plotone{figures/other.eps}\n")
+    plot = _write(tmpdir.join("figures", "plot.pdf"))
+    other = _write(tmpdir.join("figures", "other.eps"))
+    unrelated = _write(tmpdir.join("data", "table.tex"))
+    cls = _write(tmpdir.join("mycls.cls"))
+    sty = _write(tmpdir.join("local.sty"))
+
+    deps = find_dependencies(master)
+    assert deps.files == set([master, intro, plot, other, cls, sty])
+    assert deps.missing == set([str(tmpdir.join("refs.bib"))])
+    assert unrelated not in deps
+    assert str(tmpdir.join("commented.tex")) not in deps
+    assert deps.directories == set([str(tmpdir),
+                                    str(tmpdir.join("sections")),
+                                    str(tmpdir.join("figures"))])
+
+
+def test_missing_input(tmpdir):
+    """Test that inputs which do not exist yet are reported as missing."""
+    master = _write(tmpdir.join("paper.tex"), u"\\include{chapter}\n")
+    deps = find_dependencies(master)
+    assert deps.files == set([master])
+    assert deps.missing == set([str(tmpdir.join("chapter.tex"))])
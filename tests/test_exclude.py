@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for excluding environments from the diff with
+:mod:`preprint.exclude`.
+"""
+
+from preprint.exclude import mask_environments, restore_environments, \
+    CHANGED_MARKER
+from preprint.worddiff import diff_body
+
+
+TABLE = (u"\\begin{table}\n"
+         u"\\begin{tabular}{ll}\n"
+         u"a & b \\\\\n"
+         u"\\end{tabular}\n"
+         u"\\end{table}")
+
+DOC = u"Some text.\n" + TABLE + u"\nMore text.\n"
+
+
+def test_mask_environments():
+    """Test that nested environments are masked as one region."""
+    tex, regions = mask_environments(DOC, ["table", "tabular"])
+    assert len(regions) == 1
+    assert regions.values() == [TABLE]
+    assert tex.startswith(u"Some text.\n\\PREPRINTEXCLUDED{")
+    assert TABLE not in tex
+    assert mask_environments(DOC, []) == (DOC, {})
+
+
+def _diff(prev, current):
+    prev_tex, prev_regions = mask_environments(prev, ["table"])
+    current_tex, current_regions = mask_environments(current, ["table"])
+    return restore_environments(diff_body(prev_tex, current_tex),
+                                prev_regions, current_regions)
+
+
+def test_unchanged_environment():
+    """Test that unchanged environments are restored as they are."""
+    tex = _diff(DOC.replace(u"Some", u"Old"), DOC)
+    assert TABLE in tex
+    assert CHANGED_MARKER not in tex
+
+
+def test_changed_environment():
+    """Test that changed environments are marked and the old version is
+    commented out.
+    """
+    tex = _diff(DOC.replace(u"a & b", u"a & c"), DOC)
+    assert CHANGED_MARKER + TABLE in tex
+    assert u"%DIFDELCMD < a & c" in tex
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for content change detection with
+:class:`preprint.filehash.FileHashCache`.
+"""
+
+import os
+
+from preprint.filehash import FileHashCache
+
+
+def test_content_change_detection(tmpdir):
+    """Test that only real content changes are reported."""
+    path = tmpdir.join("paper.tex")
+    path.write("Hello")
+    cache = FileHashCache()
+    assert cache.update(str(path)) is True
+    assert cache.update(str(path)) is False
+
+    # Touching the file changes its mtime but not its content
+    st = os.stat(str(path))
+    os.utime(str(path), (st.st_atime, st.st_mtime + 10))
+    assert cache.update(str(path)) is False
+
+    path.write("Hello, world")
+    assert cache.update(str(path)) is True
+
+    path.remove()
+    assert cache.update(str(path)) is True
+    assert cache.update(str(path)) is False
+    assert cache.digest(str(path)) is None
+
+
+def test_prime(tmpdir):
+    """Test that priming records new files but keeps pending changes."""
+    paths = [tmpdir.join(name) for name in ("a.tex", "b.tex")]
+    for path in paths:
+        path.write("Hello")
+    cache = FileHashCache()
+    cache.update(str(paths[0]))
+    paths[0].write("Hello, world")
+    cache.prime([str(path) for path in paths])
+    assert cache.update(str(paths[0])) is True
+    assert cache.update(str(paths[1])) is False
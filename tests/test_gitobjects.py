@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for reading git objects with
+:class:`preprint.gitobjects.GitObjectReader`.
+"""
+
+import os
+
+import pytest
+
+from preprint.cache import TextCache
+from preprint.gitobjects import GitObjectReader, GitObjectError, \
+    CommitResolver, TreeFiles, is_sha
+from preprint.depgraph import find_dependencies
+
+
+@pytest.fixture
+def repo(git_repo, git):
+    """A git repository with two commits."""
+    git_repo.join("paper.tex").write("\\input{sections/intro}\n")
+    git_repo.join("sections").ensure(dir=True)
+    git_repo.join("sections", "intro.tex").write("First draft\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'First')
+    git(git_repo, 'tag', 'v1')
+    git_repo.join("sections", "intro.tex").write("Second draft\n")
+    git(git_repo, 'commit', '-q', '-a', '-m', 'Second')
+    return str(git_repo)
+
+
+def test_read_blob(repo):
+    """Test reading files from the trees of different commits."""
+    reader = GitObjectReader(repo)
+    try:
+        assert reader.read_text('v1', 'sections/intro.tex') == \
+            u"First draft\n"
+        assert reader.read_text('HEAD', 'sections/intro.tex') == \
+            u"Second draft\n"
+        assert reader.read_blob('HEAD', 'paper.tex') == \
+            b"\\input{sections/intro}\n"
+        assert reader.has_blob('v1', 'sections/../paper.tex')
+        assert sorted(reader.tree('v1')) == \
+            [u'paper.tex', u'sections/intro.tex']
+        with pytest.raises(GitObjectError):
+            reader.read_blob('v1', 'missing.tex')
+    finally:
+        reader.close()
+    assert reader.closed
+
+
+def test_resolve(repo, git):
+    """Test resolving references to full commit SHAs."""
+    reader = GitObjectReader(repo)
+    try:
+        head = git(repo, 'rev-parse', 'HEAD')
+        assert reader.resolve('HEAD') == head
+        assert reader.resolve(head[:7]) == head
+        assert reader.resolve('v1') == git(repo, 'rev-parse', 'v1')
+        with pytest.raises(GitObjectError):
+            reader.resolve('no-such-ref')
+    finally:
+        reader.close()
+
+
+def test_commit_resolver(repo, tmpdir, git):
+    """Test counting and matching commits with the SHA index."""
+    resolver = CommitResolver(GitObjectReader(repo),
+                              cache=TextCache('commits',
+                                              cache_dir=str(tmpdir)))
+    head = git(repo, 'rev-parse', 'HEAD')
+    first = git(repo, 'rev-parse', 'v1')
+    assert resolver.count() == 2
+    assert resolver.count('v1') == 1
+    assert resolver.history() == [head, first]
+    assert resolver.match(first[:6]) == first
+    assert resolver.match(head.upper()[:8]) == head
+    assert resolver.match('xyz') is None
+    assert resolver.resolve('v1') == first
+    assert resolver.resolve('no-such-ref') is None
+
+
+def test_tree_files(repo):
+    """Test finding the dependencies of a revision in its tree."""
+    reader = GitObjectReader(repo)
+    try:
+        files = TreeFiles(reader, 'v1')
+        master = os.path.join(repo, "paper.tex")
+        intro = os.path.join(repo, "sections", "intro.tex")
+        assert files.exists(intro)
+        assert not files.exists(os.path.join(repo, "missing.tex"))
+        assert files.read_text(intro) == u"First draft\n"
+        assert files.blob_sha(intro) != TreeFiles(reader, 'HEAD').blob_sha(
+            intro)
+        deps = find_dependencies(master, files=files)
+        assert deps.files == set([master, intro])
+    finally:
+        reader.close()
+
+
+def test_is_sha(repo, git):
+    """Test telling SHAs from refs that look like them."""
+    git(repo, 'branch', 'cafe')
+    head = git(repo, 'rev-parse', 'HEAD')
+    assert is_sha(head, repo)
+    assert is_sha(head[:7].upper(), repo)
+    for ref in ('cafe', 'HEAD', 'HEAD~1', 'v1', head[:3]):
+        assert not is_sha(ref, repo)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for :mod:`preprint.latexdiff`: expanding git refs into difference
+jobs, inlining documents, and running the diff pipeline with fake
+``latexdiff`` and ``latexmk`` commands (see ``conftest.py``).
+"""
+
+import codecs
+import argparse
+from multiprocessing.pool import ThreadPool
+
+from preprint.cache import TextCache, cache_key
+from preprint.config import Configurations
+from preprint.gitobjects import GitObjectReader
+from preprint.latexdiff import Diff, diff_jobs, inline_revision, \
+    inline_tex, inline_prev, git_diff_pipeline, kept_build_dir, \
+    BackgroundWorker
+
+
+class _App(object):
+    """The parts of :class:`preprint.main.PreprintApp` that commands use."""
+
+    def __init__(self, master):
+        super(_App, self).__init__()
+        self.options = argparse.Namespace(master=master)
+        self.confs = Configurations()
+
+
+def test_diff_jobs(git_repo, git, monkeypatch):
+    """Test expanding plain refs, ranges and names."""
+    shas = []
+    for i in range(3):
+        git_repo.join("paper.tex").write("Draft {0:d}\n".format(i))
+        git(git_repo, 'add', '.')
+        git(git_repo, 'commit', '-q', '-m', "Draft {0:d}".format(i))
+        shas.append(git(git_repo, 'rev-parse', 'HEAD'))
+    git(git_repo, 'tag', 'v1', shas[0])
+    monkeypatch.chdir(git_repo)
+
+    assert diff_jobs(['v1', 'origin/main'], "paper.tex") == [
+        ("current_v1", 'v1', None),
+        ("current_origin-main", 'origin/main', None)]
+    assert diff_jobs(['v1'], "paper.tex", current_commit='HEAD') == [
+        ("v1_HEAD", 'v1', 'HEAD')]
+    assert diff_jobs(['v1..HEAD'], "paper.tex") == [
+        ("{0}_{1}".format(a[:7], b[:7]), a, b)
+        for a, b in zip(shas[:-1], shas[1:])]
+    assert diff_jobs(['v1'], "paper.tex", name="referee") == [
+        ("referee", 'v1', None)]
+    assert [job[0] for job in diff_jobs(['v1..HEAD'], "paper.tex",
+                                        name="referee")] == [
+        "referee_{0}_{1}".format(a[:7], b[:7])
+        for a, b in zip(shas[:-1], shas[1:])]
+
+
+def test_inline_tex():
+    """Test inlining \\input, \\include and \\InputIfFileExists."""
+    docs = {u"a.tex": u"A \\input{sub/b}",
+            u"sub/b.tex": u"B",
+            u"c.tex": u"C \\include{c}"}
+    tex = (u"\\input{a}|\\include{ c.tex }|\\includegraphics{a}|"
+           u"\\InputIfFileExists{a}{then }{else}|"
+           u"\\InputIfFileExists{missing}{then}{else \\input{sub/b}}|"
+           u"\\input{missing}")
+    assert inline_tex(tex, docs.get) == (
+        u"A B|C |\\includegraphics{a}|then A B|else B|")
+
+
+def test_inline_revision(git_repo, git):
+    """Test that nested documents are read from the revision, not from the
+    working tree.
+    """
+    git_repo.join("paper.tex").write(
+        "\\input{sections/intro}\n% \\input{sections/old}\n")
+    git_repo.mkdir("sections").join("intro.tex").write(
+        "Intro text v1. \\input{sections/details}\n")
+    git_repo.join("sections", "details.tex").write("Details v1.\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'First')
+    sha = git(git_repo, 'rev-parse', 'HEAD')
+    git_repo.join("sections", "intro.tex").write("Intro text WT.\n")
+    git_repo.join("sections", "details.tex").write("Details WT.\n")
+
+    reader = GitObjectReader(str(git_repo))
+    try:
+        text = inline_revision(reader, sha, 'paper.tex')
+    finally:
+        reader.close()
+    assert text.startswith(u"Intro text v1. Details v1.\n")
+    assert u"WT" not in text
+    assert u"old" not in text
+
+
+def test_inline_prev_cache(git_repo, git, monkeypatch):
+    """Test that inlined revisions are cached under the inliner's version,
+    so entries written by older inliners are never used.
+    """
+    git_repo.join("paper.tex").write("\\input{intro}\n")
+    git_repo.join("intro.tex").write("Intro text v1.\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'First')
+    sha = git(git_repo, 'rev-parse', 'HEAD')
+    monkeypatch.chdir(git_repo)
+    cache = TextCache('revisions', cache_dir=str(git_repo.join("cache")))
+    cache.put(cache_key(sha, u"paper.tex"), u"Stale text.\n")
+
+    output_path = inline_prev('HEAD', "paper.tex", cache=cache,
+                              output_dir=str(git_repo))
+    with codecs.open(output_path, 'r', encoding='utf-8') as f:
+        assert f.read() == u"Intro text v1.\n\n"
+    assert len(git_repo.join("cache", "revisions").listdir()) == 2
+
+
+def test_git_diff_pipeline_revisions(git_repo, git, tex_tools, monkeypatch):
+    """Test diffing two revisions with only the files of the newer one."""
+    git_repo.join("paper.tex").write(
+        "\\documentclass{article}\n\\begin{document}\n\\input{intro}\n"
+        "\\includegraphics{figs/plot}\n\\end{document}\n")
+    git_repo.join("intro.tex").write("Old intro.\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'First')
+    git(git_repo, 'tag', 'v1')
+    git_repo.join("intro.tex").write("New intro.\n")
+    git_repo.mkdir("figs").join("plot.pdf").write("Plot v2\n")
+    # Its name appears in the text, but it is not a dependency
+    git_repo.join("a.pdf").write("Unrelated\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'Second')
+    git(git_repo, 'tag', 'v2')
+    git_repo.join("intro.tex").write("WT intro.\n")
+    git_repo.join("figs", "plot.pdf").remove()
+    monkeypatch.chdir(git_repo)
+
+    scratch_root = git_repo.mkdir(".scratch")
+    git_diff_pipeline("v1_v2", "paper.tex", 'v1', current_commit='v2',
+                      scratch_root=str(scratch_root))
+    pdf = git_repo.join("build", "v1_v2.pdf").read()
+    assert u"== ./figs/plot.pdf\nPlot v2\n" in pdf
+    assert u"a.pdf" not in pdf
+    assert u"Old intro." in pdf and u"New intro." in pdf
+    assert u"WT intro." not in pdf
+    assert tex_tools() == ["latexdiff", "latexmk"]
+    assert scratch_root.listdir() == []
+
+
+def test_git_diff_pipeline_scratch(paper, tex_tools):
+    """Test that concurrent pipelines each build in their own scratch
+    directory, and only publish the PDF.
+    """
+    scratch_root = paper.mkdir(".scratch")
+
+    def run(output_name):
+        git_diff_pipeline(output_name, "paper.tex", 'v1',
+                          scratch_root=str(scratch_root))
+    pool = ThreadPool(2)
+    try:
+        pool.map(run, ["a", "b"])
+    finally:
+        pool.close()
+        pool.join()
+
+    for output_name in ("a", "b"):
+        pdf = paper.join("build", output_name + ".pdf").read()
+        assert u"== ./{0}.tex\n% diff of _prev.tex and _current.tex\n" \
+            u"\\documentclass".format(output_name) in pdf
+        assert u"First draft." in pdf and u"Second draft." in pdf
+    assert scratch_root.listdir() == []
+    assert sorted(p.basename for p in paper.listdir()) == [
+        ".git", ".scratch", ".tools", "build", "intro.tex", "paper.tex"]
+
+
+def test_diff_keep_clean(paper, tex_tools):
+    """Test keeping the auxiliary files of a diff between runs, and
+    deleting them.
+    """
+    diff = Diff(_App("paper.tex"), None)
+    parser = diff.get_parser("preprint diff")
+    diff.take_action(parser.parse_args(['v1', '--keep']))
+    paper.join("intro.tex").write("Third draft.\n")
+    diff.take_action(parser.parse_args(['v1', '--keep']))
+
+    build_dir = paper.join(kept_build_dir("current_v1"))
+    assert build_dir.join("current_v1.aux").read() == "run\nrun\n"
+    # latexmk expects to find its previous output
+    assert build_dir.join("current_v1.pdf").check()
+    assert u"Third draft." in paper.join("build", "current_v1.pdf").read()
+
+    diff.take_action(parser.parse_args(['v1', '--clean']))
+    assert not build_dir.check()
+    assert paper.join("build", "current_v1.pdf").check()
+
+
+def test_diff_cache(paper, git, tex_tools):
+    """Test that latexdiff output is cached by both documents and the diff
+    options.
+    """
+    cache = TextCache('latexdiff', cache_dir=str(paper.join(".cache")))
+
+    def run(prev_commit, n_latexdiff, **kwargs):
+        git_diff_pipeline("diff", "paper.tex", prev_commit,
+                          diff_cache=cache, **kwargs)
+        assert tex_tools().count("latexdiff") == n_latexdiff
+        return paper.join("build", "diff.pdf").read()
+
+    run('v1', 1)
+    assert u"Second draft." in run('v1', 1)
+    run('v1', 2, exclude=["table"])
+    paper.join("intro.tex").write("Third draft.\n")
+    assert u"Third draft." in run('v1', 3)
+    git(paper, 'commit', '-q', '-a', '-m', 'Third')
+    git(paper, 'tag', 'v2')
+    run('v2', 4)
+    assert u"First draft." in run('v1', 4)
+    assert tex_tools().count("latexmk") == 6
+
+
+def test_background_worker(paper, tex_tools):
+    """Test publishing the PDF and deleting the scratch directory in the
+    background.
+    """
+    scratch_root = paper.mkdir(".scratch")
+    worker = BackgroundWorker()
+    try:
+        git_diff_pipeline("diff", "paper.tex", 'v1',
+                          scratch_root=str(scratch_root), background=worker)
+        worker.wait()
+        assert u"Second draft." in paper.join("build", "diff.pdf").read()
+        assert scratch_root.listdir() == []
+
+        def fail():
+            raise IOError("No space left on device")
+        # Failures are logged, not raised
+        worker.submit(fail)
+        worker.wait()
+    finally:
+        worker.close()
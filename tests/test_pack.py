@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for discovering and installing figures with :mod:`preprint.pack`.
+"""
+
+import json
+
+import pytest
+
+from preprint.cache import FileCache, cache_key
+from preprint.filehash import file_digest
+from preprint.pack import discover_figures, install_figs, \
+    rewrite_figure_paths, FigureInstallError, MANIFEST_NAME, RASTER_SETTINGS
+
+
+def _raster_key(path):
+    """Raster cache key of a figure with the default conversion settings."""
+    return cache_key("convert", file_digest(path),
+                     str(RASTER_SETTINGS['density']),
+                     str(RASTER_SETTINGS['quality']),
+                     str(RASTER_SETTINGS['trim']))
+
+
+def test_rasterize_jpg_keeps_source(tmpdir, monkeypatch):
+    """Test that rasterizing a .jpg figure never touches the source."""
+    monkeypatch.chdir(tmpdir)
+    tmpdir.mkdir("figs").join("a.jpg").write("original", mode='wb')
+    tmpdir.mkdir("build")
+    cache = FileCache('rasters', cache_dir=str(tmpdir.join("cache")),
+                      ext=".jpg")
+    tmpdir.join("cached.jpg").write("rasterized", mode='wb')
+    cache.put(_raster_key("figs/a.jpg"), str(tmpdir.join("cached.jpg")))
+
+    tex = u"\\includegraphics{figs/a}"
+    for i in range(2):
+        figs = discover_figures(tex, ['jpg'])
+        tex_out = install_figs(tex, figs, "build", naming="aastex",
+                               format_priority=['jpg'], max_size=1e-9,
+                               raster_cache=cache)
+        assert tex_out == u"\\includegraphics{f1}"
+        assert tmpdir.join("figs", "a.jpg").read('rb') == "original"
+        assert tmpdir.join("build", "f1.jpg").read('rb') == "rasterized"
+
+
+def test_rewrite_figure_paths():
+    """Test that every occurrence of a mapped figure is rewritten."""
+    tex = (u"\\includegraphics[width=3in]{figs/a}\n"
+           u"\\includegraphics{figs/b.pdf} \\includegraphics{figs/a}\n"
+           u"\\includegraphics{other}")
+    assert rewrite_figure_paths(tex, {u"figs/a": u"f1",
+                                      u"figs/b.pdf": u"f2"}) == (
+        u"\\includegraphics[width=3in]{f1}\n"
+        u"\\includegraphics{f2} \\includegraphics{f1}\n"
+        u"\\includegraphics{other}")
+
+
+def test_discover_figures(tmpdir, monkeypatch):
+    """Test resolving figures against the directory listings."""
+    monkeypatch.chdir(tmpdir)
+    figs_dir = tmpdir.mkdir("figs")
+    figs_dir.join("a.pdf").write("a" * 2000, mode='wb')
+    figs_dir.join("a.eps").write("a" * 1000, mode='wb')
+    figs_dir.join("b.eps").write("b", mode='wb')
+    tmpdir.join("c.pdf").write("c", mode='wb')
+    tex = (u"\\includegraphics[width=3in]{figs/a}\n"
+           u"\\includegraphics{figs/b.eps}\n"
+           u"\\includegraphics{c}\n"
+           u"\\includegraphics{missing/d}\n")
+    figs = discover_figures(tex, ['pdf', 'eps'])
+    assert sorted(figs) == ['a', 'b', 'c', 'd']
+    assert figs['a']['exts'] == ('pdf', 'eps')
+    assert figs['a']['size_mb'] == [0.002, 0.001]
+    assert figs['a']['options'] == u"[width=3in]"
+    assert figs['b']['exts'] == ('eps',)
+    assert figs['c']['exts'] == ('pdf',)
+    assert figs['d']['exts'] == ()
+    assert [figs[k]['num'] for k in 'abcd'] == [1, 2, 3, 4]
+
+
+def test_install_figs(tmpdir, monkeypatch):
+    """Test installing figures in parallel, and installing them again
+    incrementally.
+    """
+    monkeypatch.chdir(tmpdir)
+    figs_dir = tmpdir.mkdir("figs")
+    for name in "abcd":
+        figs_dir.join(name + ".pdf").write(name * 10, mode='wb')
+    tmpdir.mkdir("build")
+    tex = u"".join(u"\\includegraphics{{figs/{0}}}\n".format(name)
+                   for name in "abcd")
+
+    def install(tex):
+        return install_figs(tex, discover_figures(tex, ['pdf']), "build",
+                            naming="arxiv", format_priority=['pdf'],
+                            jobs=3)
+
+    assert install(tex) == u"".join(
+        u"\\includegraphics{{figure{0:d}}}\n".format(i) for i in range(1, 5))
+    build_dir = tmpdir.join("build")
+    assert sorted(p.basename for p in build_dir.listdir()) == [
+        MANIFEST_NAME, "figure1.pdf", "figure2.pdf", "figure3.pdf",
+        "figure4.pdf"]
+    assert build_dir.join("figure3.pdf").read('rb') == "c" * 10
+
+    # Unchanged figures are left alone; changed, edited and deleted ones
+    # are installed again
+    mtime = build_dir.join("figure3.pdf").mtime()
+    build_dir.join("figure1.pdf").write("edited", mode='wb')
+    build_dir.join("figure2.pdf").remove()
+    figs_dir.join("b.pdf").write("B" * 10, mode='wb')
+    install(tex)
+    assert figs_dir.join("a.pdf").read('rb') == "a" * 10
+    assert build_dir.join("figure1.pdf").read('rb') == "a" * 10
+    assert build_dir.join("figure2.pdf").read('rb') == "B" * 10
+    assert build_dir.join("figure3.pdf").mtime() == mtime
+
+    # Figures dropped from the manuscript are deleted
+    install(tex.replace(u"\\includegraphics{figs/d}\n", u""))
+    assert not build_dir.join("figure4.pdf").check()
+    assert sorted(json.loads(build_dir.join(MANIFEST_NAME).read())) == [
+        "figure1.pdf", "figure2.pdf", "figure3.pdf"]
+
+
+def test_install_figs_error(tmpdir, monkeypatch):
+    """Test that install errors name the figure."""
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("a.pdf").write("a", mode='wb')
+    tmpdir.mkdir("build")
+    tex = u"\\includegraphics{a}"
+    figs = discover_figures(tex, ['pdf'])
+    tmpdir.join("a.pdf").remove()
+    with pytest.raises(FigureInstallError) as excinfo:
+        install_figs(tex, figs, "build", format_priority=['pdf'])
+    assert "a (a.pdf)" in str(excinfo.value)
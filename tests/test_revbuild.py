@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for building past revisions with
+:func:`preprint.revbuild.build_revision`.
+"""
+
+import pytest
+
+from preprint.cache import FileCache
+from preprint.revbuild import build_revision
+
+
+@pytest.fixture
+def repo(git_repo, git, monkeypatch):
+    """A git repository with a tagged commit, as the current directory."""
+    git_repo.join("paper.tex").write("First draft\n")
+    git(git_repo, 'add', '.')
+    git(git_repo, 'commit', '-q', '-m', 'First')
+    git(git_repo, 'tag', 'v1')
+    git_repo.join("paper.tex").write("Second draft\n")
+    monkeypatch.chdir(git_repo)
+    return git_repo
+
+
+def test_failed_build_not_cached(repo):
+    """Test that builds that fail are not cached, even with a PDF."""
+    cache = FileCache('pdfs', cache_dir=str(repo.join("cache")), ext=".pdf")
+    assert build_revision('v1', "paper.tex", "cp paper.tex paper.pdf; exit 1",
+                          cache=cache, quiet=True) is None
+    assert not repo.join("cache").check()
+    pdf_path = build_revision('v1', "paper.tex", "cp paper.tex paper.pdf",
+                              cache=cache, quiet=True)
+    with open(pdf_path) as f:
+        assert f.read() == "First draft\n"
+
+
+def test_vc(repo, git):
+    """Test that vc.tex is generated for the revision."""
+    repo.join("vc").write("#!/bin/sh\n")
+    repo.join("vc-git.awk").write(
+        'script == "log" && /^Abr. Hash:/ '
+        '{ print "\\\\gdef\\\\GITAbrHash{" $3 "}" }\n')
+    cache = FileCache('pdfs', cache_dir=str(repo.join("cache")), ext=".pdf")
+    pdf_path = build_revision('v1', "paper.tex", "cp vc.tex paper.pdf",
+                              cache=cache, quiet=True)
+    with open(pdf_path) as f:
+        assert f.read() == "\\gdef\\GITAbrHash{{{0}}}\n".format(
+            git(repo, 'rev-parse', '--short', 'v1'))
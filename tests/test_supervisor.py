@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for cancelling builds with :class:`preprint.supervisor.BuildSupervisor`.
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from preprint.supervisor import BuildSupervisor, BuildCancelled
+
+
+def _group_exists(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.skipif("os.name != 'posix'")
+def test_cancel():
+    """Test that cancelling a build kills its whole process group."""
+    supervisor = BuildSupervisor(kill_timeout=0.5)
+    errors = []
+
+    def build():
+        try:
+            # A shell with a child process, like latexmk running pdflatex
+            supervisor.call("sleep 30 & wait")
+        except BuildCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=build)
+    thread.start()
+    for i in range(100):
+        if supervisor._procs:
+            break
+        time.sleep(0.05)
+    pgid = list(supervisor._procs)[0].pid
+    assert _group_exists(pgid)
+
+    supervisor.cancel()
+    thread.join(10.)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    for i in range(40):
+        if not _group_exists(pgid):
+            break
+        time.sleep(0.05)
+    assert not _group_exists(pgid)
+    with pytest.raises(BuildCancelled):
+        supervisor.call("true")
+    supervisor.reset()
+    assert supervisor.call("exit 3") == 3
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for :mod:`preprint.watch`.
+"""
+
+import os
+import time
+import threading
+
+import preprint.latexdiff
+from preprint.watch import is_ignored, CompileQueue, RegularChangeHandler, \
+    DiffChangeHandler
+
+
+class _Observer(object):
+    """Stand-in for a watchdog observer."""
+
+    def schedule(self, handler, path, recursive=False):
+        return path
+
+    def unschedule(self, watch):
+        pass
+
+
+class _Event(object):
+    """Stand-in for a watchdog file modification event."""
+
+    def __init__(self, src_path):
+        super(_Event, self).__init__()
+        self.src_path = src_path
+        self.is_directory = False
+
+
+def test_is_ignored():
+    """Test that ignores only apply within the project directory."""
+    project_dir = os.path.join(os.sep, "home", "me", "builds", "paper")
+    ignores = ("paper.pdf", "build", "_current.tex", ".preprint-cache")
+    for path in ("paper.tex", "figs/f1.pdf", "../shared/build/f2.pdf"):
+        assert not is_ignored(os.path.join(project_dir, path), ignores,
+                              project_dir)
+    for path in ("paper.pdf", "build/paper_diff.pdf", "paper_current.tex",
+                 ".preprint-cache/revisions/abc.txt"):
+        assert is_ignored(os.path.join(project_dir, path), ignores,
+                          project_dir)
+
+
+def test_dependency_hashes_primed(tmpdir, monkeypatch):
+    """Test that the first event of a dependency whose content did not
+    change does not trigger a compile.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("paper.tex").write("\\input{intro}\n")
+    tmpdir.join("intro.tex").write("First draft.\n")
+    handler = RegularChangeHandler("true", ["tex"], [],
+                                   master_path="paper.tex")
+    notified = []
+    monkeypatch.setattr(handler._queue, 'notify', notified.append)
+    handler.schedule(_Observer())
+
+    intro_path = str(tmpdir.join("intro.tex"))
+    st = os.stat(intro_path)
+    os.utime(intro_path, (st.st_atime, st.st_mtime + 10))
+    handler.on_any_event(_Event(intro_path))
+    assert notified == []
+    tmpdir.join("intro.tex").write("Second draft.\n")
+    handler.on_any_event(_Event(intro_path))
+    assert notified == [intro_path]
+
+
+def test_compile_queue_debounce():
+    """Test that a burst of notifications gives a single compile."""
+    compiles = []
+    queue = CompileQueue(lambda: compiles.append(time.time()), delay=0.1)
+    queue.start()
+    try:
+        for i in range(5):
+            queue.notify("paper.tex")
+            time.sleep(0.02)
+        time.sleep(0.4)
+        assert len(compiles) == 1
+    finally:
+        queue.stop()
+
+
+def test_compile_queue_follow_up():
+    """Test that notifications during a compile give exactly one follow-up
+    compile.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    compiles = []
+
+    def compile_func():
+        compiles.append(time.time())
+        started.set()
+        release.wait(5.)
+
+    queue = CompileQueue(compile_func, delay=0.05)
+    queue.start()
+    try:
+        queue.notify("paper.tex")
+        assert started.wait(5.)
+        for i in range(3):
+            queue.notify("figs/f1.pdf")
+        time.sleep(0.2)
+        assert len(compiles) == 1
+        release.set()
+        time.sleep(0.4)
+        assert len(compiles) == 2
+    finally:
+        release.set()
+        queue.stop()
+
+
+def test_diff_handler_prev_commit(paper, git, tex_tools, monkeypatch):
+    """Test that the previous revision is inlined once per commit, and that
+    symbolic refs are re-resolved when they move but SHAs are not.
+    """
+    inlined = []
+    inline_revision = preprint.latexdiff.inline_revision
+
+    def _inline_revision(reader, commit_ref, rel_root_tex_path):
+        inlined.append(commit_ref)
+        return inline_revision(reader, commit_ref, rel_root_tex_path)
+    monkeypatch.setattr(preprint.latexdiff, 'inline_revision',
+                        _inline_revision)
+
+    first = git(paper, 'rev-parse', 'HEAD')
+    git(paper, 'branch', 'cafe')
+    scratch_root = str(paper.mkdir(".scratch"))
+    handlers = [DiffChangeHandler("paper.tex", ref, ["tex"], [],
+                                  scratch_root=scratch_root)
+                for ref in ('HEAD', 'cafe', first[:7])]
+    try:
+        head_handler = handlers[0]
+        head_handler.run_compile()
+        head_handler.run_compile()
+        assert inlined == [first]
+        prev_path = os.path.join(head_handler._build_dir, "_prev.tex")
+        with open(prev_path) as f:
+            assert u"First draft." in f.read()
+        assert paper.join("build", "paper_diff.pdf").check()
+
+        git(paper, 'commit', '-q', '-a', '-m', 'Second')
+        second = git(paper, 'rev-parse', 'HEAD')
+        git(paper, 'branch', '-f', 'cafe', 'HEAD')
+        head_handler.run_compile()
+        assert inlined == [first, second]
+        with open(prev_path) as f:
+            assert u"Second draft." in f.read()
+        for handler in handlers[1:]:
+            handler._update_prev_commit()
+        assert [h._prev_commit for h in handlers] == [second, second, first]
+    finally:
+        for handler in handlers:
+            handler.stop()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for the built-in word diff engine, :mod:`preprint.worddiff`.
+"""
+
+from preprint.worddiff import tokenize, diff_body, diff_tex, TEXT, BLOCK, \
+    DIFF_PREAMBLE
+
+
+DOC = (u"\\documentclass{article}\n"
+       u"\\begin{document}\n"
+       u"\\section{Introduction}\n"
+       u"The quick brown fox % a comment\n"
+       u"jumps over \\emph{the lazy} dog $x^2$.\n"
+       u"\n"
+       u"\\begin{equation}\n"
+       u"E = mc^2\n"
+       u"\\end{equation}\n"
+       u"\\end{document}\n")
+
+
+def test_tokenize():
+    """Test that tokens reproduce the text and are classified."""
+    tokens, trailing = tokenize(DOC)
+    assert u"".join(s + t for s, t, k in tokens) + trailing == DOC
+    kinds = dict((t, k) for s, t, k in tokens)
+    assert kinds[u"\\section{Introduction}"] == BLOCK
+    assert kinds[u"% a comment"] == BLOCK
+    assert kinds[u"\\emph{the lazy}"] == TEXT
+    assert kinds[u"$x^2$"] == TEXT
+    assert kinds[u"\\begin{equation}\nE = mc^2\n\\end{equation}"] == BLOCK
+
+
+def test_unchanged():
+    """Test that identical documents only gain the preamble."""
+    tex = diff_tex(DOC, DOC)
+    assert tex == DOC.replace(u"\\begin{document}",
+                              DIFF_PREAMBLE + u"\\begin{document}")
+
+
+def test_changed_words():
+    """Test marking up added and deleted words."""
+    tex = diff_body(u"The quick brown fox.", u"The quick red fox.")
+    assert tex == u"The quick \\DIFdel{brown} \\DIFadd{red} fox."
+
+
+def test_deleted_command():
+    """Test that deleted commands are commented out without swallowing the
+    following text.
+    """
+    tex = diff_body(u"Text \\label{a} more", u"Text more")
+    assert tex == u"Text %DIFDELCMD < \\label{a}\n more"